@@ -2,10 +2,20 @@ r"""Convinient wrapper for various off-the-shelf popular ML classifiers.
 
 This file is effectively a configuration file, specifying (a) the classifiers
 to be considered, and (b) the hyper-parameters for each classifier. It makes no
-attempt to do any kind of optimizations what-so-ever.
+attempt to optimize the models themselves, but lets the runs be executed on
+threads, on a pool of worker processes, or sequentially.
 """
 
+import multiprocessing
+import multiprocessing.sharedctypes
+import numpy as np
+import pickle
+import resource
+import scipy.sparse
+import sys
 import threading
+import time
+import traceback
 
 from sklearn import linear_model
 from sklearn import svm
@@ -14,9 +24,11 @@ from sklearn import ensemble
 from sklearn import neural_network
 from sklearn import gaussian_process
 from sklearn import naive_bayes
-from sklearn import discriminant_analysis 
+from sklearn import discriminant_analysis
 
+from sklearn.base import clone
 from sklearn.metrics import classification_report
+from sklearn.model_selection import KFold
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 
@@ -24,7 +36,7 @@ from sklearn.preprocessing import StandardScaler
 """Classifier configurations.
 
 Keys are the classifier class names, value is a
-pair consisting of the sklearn package name and the model constructor 
+pair consisting of the sklearn package name and the model constructor
 parameters.
 """
 _CLASSIFIER_CONFIGS = {
@@ -39,6 +51,40 @@ _CLASSIFIER_CONFIGS = {
   'GaussianNB': (naive_bayes, {}),
 }
 
+"""Classifiers that only accept dense data, so they are skipped for sparse data.
+"""
+_DENSE_ONLY_CLASSIFIERS = [
+  'GaussianProcessClassifier',
+  'GaussianNB',
+]
+
+"""Supported ways to execute the classification runs.
+
+  - 'thread': One thread per model. Cheap to start, but pure-Python parts of
+    the fitting serialize on the GIL.
+  - 'process': Worker processes, which share the data through shared memory.
+    Required for time budgets, as only processes can be killed.
+  - 'sequential': One model after another in the calling thread.
+"""
+_EXECUTORS = ['thread', 'process', 'sequential']
+
+# Seconds to wait between checks on the worker processes.
+_POLL_INTERVAL = 0.1
+
+# Bytes per unit of ru_maxrss, which is kilobytes on Linux but bytes on macOS.
+_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+"""Per-model resource metrics recorded by Run(), averaged over folds.
+
+  - 'fit_time': Seconds to fit the model.
+  - 'predict_time': Seconds to predict the testing set.
+  - 'peak_rss_delta': Bytes by which fitting and predicting raised the peak
+    resident set size. Only isolated per model with the 'process' executor;
+    with threads, it includes concurrently running models.
+  - 'model_size': Bytes of the pickled fitted model.
+"""
+_METRICS = ['fit_time', 'predict_time', 'peak_rss_delta', 'model_size']
+
 
 def GetVotingClassifier():
   models = [
@@ -49,71 +95,438 @@ def GetVotingClassifier():
   return ensemble.VotingClassifier(estimators=models)
 
 
+def _EmptyScores():
+  """Returns the scores of a model that has not been run."""
+  return dict(
+    {
+      'training': 0,
+      'testing': 0,
+      'training_std': 0,
+      'testing_std': 0,
+      'timed_out': False,
+      'skipped': False,
+      'report': 'N.A.',
+    },
+    **{metric: 0 for metric in _METRICS})
+
+
+def _ToSharedArray(array):
+  """Copies a numpy array into shared memory.
+
+  Returns: Tuple of the shared buffer, dtype and shape. It can be passed to a
+    child process at creation time, without pickling the array data.
+  """
+  array = np.ascontiguousarray(array)
+  if array.dtype == object:
+    array = array.astype(str)
+  # Allocate at least one byte, as empty shared buffers are not supported.
+  shared = multiprocessing.sharedctypes.RawArray('b', max(array.nbytes, 1))
+  _FromSharedArray((shared, array.dtype.str, array.shape))[...] = array
+  return shared, array.dtype.str, array.shape
+
+
+def _FromSharedArray(shared_array):
+  """Returns a numpy view of an array created by _ToSharedArray()."""
+  shared, dtype, shape = shared_array
+  nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+  return np.frombuffer(shared, dtype=np.uint8)[:nbytes].view(dtype).reshape(
+    shape)
+
+
+def _ShareData(X, y):
+  """Copies the data into shared memory, see _ToSharedArray().
+
+  Sparse X is shared as its CSR components.
+  """
+  shared_data = {'y': _ToSharedArray(y)}
+  if scipy.sparse.issparse(X):
+    X = scipy.sparse.csr_matrix(X)
+    shared_data['X_shape'] = X.shape
+    for key in ['data', 'indices', 'indptr']:
+      shared_data['X_' + key] = _ToSharedArray(getattr(X, key))
+  else:
+    shared_data['X'] = _ToSharedArray(X)
+  return shared_data
+
+
+def _AttachData(shared_data):
+  """Returns the X and y shared by _ShareData() without copying them."""
+  y = _FromSharedArray(shared_data['y'])
+  if 'X' in shared_data:
+    return _FromSharedArray(shared_data['X']), y
+  X = scipy.sparse.csr_matrix(
+    tuple(
+      _FromSharedArray(shared_data['X_' + key])
+      for key in ['data', 'indices', 'indptr']),
+    shape=shared_data['X_shape'])
+  return X, y
+
+
+def _SplitRows(X, fold):
+  """Splits rows into the rows outside and inside the fold's test block.
+
+  Args:
+    X: Dense or sparse array, or 1-D labels.
+    fold (tuple[int, int]): Start and end row of the test block.
+
+  Returns: Tuple of the training rows and testing rows. Both are views unless
+    the test block is in the middle of X, where the training rows are copied.
+  """
+  start, end = fold
+  if start == 0:
+    return X[end:], X[:end]
+  if end == X.shape[0]:
+    return X[:start], X[start:]
+  if scipy.sparse.issparse(X):
+    return scipy.sparse.vstack((X[:start], X[end:]), format='csr'), X[start:end]
+  return np.concatenate((X[:start], X[end:])), X[start:end]
+
+
+def _GetPeakRss():
+  """Returns the peak resident set size of this process in bytes."""
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT
+
+
+def _RunModel(model, X, y, fold):
+  """Fits and scores the model on one fold of the already scaled data.
+
+  Args:
+    model: Unfitted sklearn classifier.
+    X, y: Data with the rows of each fold's test block stored contiguously.
+    fold (tuple[int, int]): Start and end row of the test block. All other
+      rows are the training set.
+
+  Returns: Dict with the training and testing scores, the _METRICS, the
+    predictions on the testing set, and the fitted model. If fitting fails, a
+    dict with the error.
+  """
+  try:
+    X_train, X_test = _SplitRows(X, fold)
+    y_train, y_test = _SplitRows(y, fold)
+    peak_rss = _GetPeakRss()
+    start_time = time.time()
+    clf = model.fit(X_train, y_train)
+    fit_time = time.time() - start_time
+    start_time = time.time()
+    predicted = clf.predict(X_test)
+    predict_time = time.time() - start_time
+    return {
+      'training': clf.score(X_train, y_train),
+      'testing': np.mean(predicted == y_test),
+      'fit_time': fit_time,
+      'predict_time': predict_time,
+      'peak_rss_delta': _GetPeakRss() - peak_rss,
+      'model_size': len(pickle.dumps(clf, pickle.HIGHEST_PROTOCOL)),
+      'predicted': predicted,
+      'model': clf,
+    }
+  except Exception:
+    return {'error': 'Failed:\n' + traceback.format_exc()}
+
+
+def _ProcessWorker(model, shared_data, fold, connection):
+  """Entry point of a worker process, see Classifiers._RunInProcesses()."""
+  X, y = _AttachData(shared_data)
+  connection.send(_RunModel(model, X, y, fold))
+  connection.close()
+
+
 """Thread to execute ML classification algorithm.
 """
 class RunnerThread(threading.Thread):
-  def __init__(self, model, X, y, score):
+  def __init__(self, model, X, y, fold, result):
     threading.Thread.__init__(self)
     self._model = model
     self._X = X
     self._y = y
-    self._score = score
+    self._fold = fold
+    self._result = result
 
   def run(self):
-    X_train, X_test, y_train, y_test = train_test_split(self._X, self._y)
-    clf = self._model.fit(X_train, y_train)
-    self._score['training'] = clf.score(X_train, y_train)
-    self._score['testing'] = clf.score(X_test, y_test)
-    predicted = clf.predict(X_test)
-    self._score['report'] = classification_report(y_test, predicted)
+    self._result.update(_RunModel(self._model, self._X, self._y, self._fold))
 
 
 """Class that holds various classifiers.
 
 It kicks start ML classification runs in parallel, and generates final report.
+
+Args:
+  executor (str): How the models are run, one of _EXECUTORS.
+  num_workers (int): Maximum number of runs executed concurrently. Defaults to
+    one thread per run, or one process per CPU.
+  random_state (int): Seed of the train/test split, which is shared by all
+    models so that their scores are comparable. It also seeds the models that
+    take a random_state, so that runs are reproducible with any executor.
+  num_folds (int): If set, every model is cross-validated on this many folds,
+    and the report shows the mean and standard deviation of the scores over
+    the folds. Otherwise a single holdout split is used. Each (model, fold)
+    pair is run independently, so folds are executed in parallel as well.
+  model_time_budget (float): If set, seconds a model may take to run one fold,
+    including the worker process startup. Models exceeding it are killed, and
+    reported as timed out. Requires the 'process' executor.
+  time_budget (float): If set, seconds Run() may take overall. Models still
+    running or pending by then are killed or skipped, and reported as timed
+    out. Requires the 'process' executor.
 """
 class Classifiers(object):
 
-  def __init__(self):
+  def __init__(self, executor='thread', num_workers=None, random_state=42,
+               num_folds=None, model_time_budget=None, time_budget=None):
+    if executor not in _EXECUTORS:
+      raise ValueError('Unknown executor {}, expected one of {}'.format(
+        executor, _EXECUTORS))
+    if executor != 'process' and (
+        model_time_budget is not None or time_budget is not None):
+      raise ValueError('Time budgets require the process executor')
+    self._executor = executor
+    self._num_workers = num_workers
+    self._random_state = random_state
+    self._num_folds = num_folds
+    self._model_time_budget = model_time_budget
+    self._time_budget = time_budget
+    self._scaler = None
+
     self._models = {
       model: getattr(
         _CLASSIFIER_CONFIGS[model][0], model)(**_CLASSIFIER_CONFIGS[model][1])
       for model in _CLASSIFIER_CONFIGS
     }
+    for model in self._models.values():
+      if 'random_state' in model.get_params():
+        model.set_params(random_state=random_state)
 
-    self._scores = {
-      model: {
-        'training': 0,
-        'testing': 0,
-        'report': 'N.A.',
-      }
-      for model in _CLASSIFIER_CONFIGS
-    }
+    self._scores = {model: _EmptyScores() for model in _CLASSIFIER_CONFIGS}
+
+  """Fits and scores all models.
 
+  With cross-validation, Predict() uses the models fitted on the first fold.
+  """
   def Run(self, X, y):
-    threads = []
-    for model in self._models:
-      thread = RunnerThread(
-        self._models[model], 
-        StandardScaler().fit_transform(X), 
-        y, 
-        self._scores[model])
-      threads.append(thread)
-      thread.start()
+    is_sparse = scipy.sparse.issparse(X)
+    models = [
+      model for model in self._models
+      if not (is_sparse and model in _DENSE_ONLY_CLASSIFIERS)
+    ]
+    # Scores of a previous Run(), e.g. timed out or failed, are discarded.
+    for model in self._scores:
+      self._scores[model] = _EmptyScores()
+      if model not in models:
+        self._scores[model]['skipped'] = True
+        self._scores[model]['report'] = 'Skipped, as it needs dense data.'
+
+    # Scale once for all models. Sparse data, e.g. from
+    # CsvParser(sparse=True), is only scaled and not centered, as centering
+    # would densify it.
+    self._scaler = StandardScaler(with_mean=not is_sparse).fit(X)
+    X = self._scaler.transform(X)
+
+    # Split once for all models, and reorder the rows so that each fold's
+    # testing set is contiguous, which lets runs share views of the data.
+    indexes = np.arange(X.shape[0])
+    if self._num_folds is None:
+      test_indexes = [train_test_split(
+        indexes, random_state=self._random_state)[1]]
+    else:
+      test_indexes = [
+        test_index for _, test_index in KFold(
+          n_splits=self._num_folds, shuffle=True,
+          random_state=self._random_state).split(indexes)
+      ]
+    order = np.concatenate(
+      [np.setdiff1d(indexes, np.concatenate(test_indexes))] + test_indexes)
+    X, y = X[order], np.asarray(y)[order]
+    folds = []
+    start = X.shape[0] - sum(len(test_index) for test_index in test_indexes)
+    for test_index in test_indexes:
+      folds.append((start, start + len(test_index)))
+      start += len(test_index)
+
+    tasks = [(model, i) for model in models for i in range(len(folds))]
+    if self._executor == 'process':
+      results = self._RunInProcesses(tasks, X, y, folds)
+    else:
+      results = self._RunInThreads(tasks, X, y, folds)
+
+    for model in models:
+      self._CollectResults(
+        model, [results[(model, i)] for i in range(len(folds))], y, folds)
+
+  """Runs the tasks on threads, or sequentially in the calling thread.
+
+  Returns: Dict from (model, fold index) to the _RunModel() result.
+  """
+  def _RunInThreads(self, tasks, X, y, folds):
+    results = {task: {} for task in tasks}
+    threads = [
+      RunnerThread(
+        clone(self._models[model]), X, y, folds[i], results[(model, i)])
+      for model, i in tasks
+    ]
+    if self._executor == 'sequential':
+      for thread in threads:
+        thread.run()
+      return results
+
+    for i in range(len(threads)):
+      if self._num_workers and i >= self._num_workers:
+        threads[i - self._num_workers].join()
+      threads[i].start()
 
     for thread in threads:
       thread.join()
+    return results
+
+  """Runs the tasks in at most num_workers concurrent worker processes.
+
+  The data is copied into shared memory once, and attached by every worker
+  without being pickled per task. Fitted models are sent back, so that
+  Predict() works as with the other executors.
+
+  Each worker reports through its own pipe, so that killing a worker that
+  exceeds a time budget cannot corrupt the results of the others. When a task
+  times out, the remaining tasks of the same model are cancelled too.
+
+  Returns: Dict from (model, fold index) to the _RunModel() result, or to
+    {'timed_out': True} for cancelled tasks.
+  """
+  def _RunInProcesses(self, tasks, X, y, folds):
+    start_time = time.time()
+    num_workers = self._num_workers or multiprocessing.cpu_count()
+    shared_data = _ShareData(X, y)
+    pending = list(tasks)
+    running = {}
+    results = {}
+
+    while pending or running:
+      while pending and len(running) < num_workers:
+        task = pending.pop(0)
+        model, i = task
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+          target=_ProcessWorker,
+          args=(self._models[model], shared_data, folds[i], sender))
+        process.start()
+        # Only the worker holds the sending end, so the pipe hits EOF if the
+        # worker dies without sending a result.
+        sender.close()
+        running[task] = (process, receiver, time.time())
+
+      ready = [task for task in running if running[task][1].poll()]
+      for task in ready:
+        process, receiver, _ = running.pop(task)
+        try:
+          results[task] = receiver.recv()
+        except EOFError:
+          results[task] = {}
+        receiver.close()
+        process.join()
+        if not results[task]:
+          results[task] = {
+            'error': 'Failed: worker exited with code {}'.format(
+              process.exitcode),
+          }
+
+      now = time.time()
+      timed_out_models = set()
+      if self._time_budget is not None and now - start_time > self._time_budget:
+        timed_out_models.update(model for model, _ in list(running) + pending)
+      if self._model_time_budget is not None:
+        timed_out_models.update(
+          task[0] for task in running
+          if now - running[task][2] > self._model_time_budget)
+
+      for task in list(running):
+        if task[0] in timed_out_models:
+          process, receiver, _ = running.pop(task)
+          process.terminate()
+          process.join()
+          receiver.close()
+          results[task] = {'timed_out': True}
+      for task in list(pending):
+        if task[0] in timed_out_models:
+          pending.remove(task)
+          results[task] = {'timed_out': True}
+
+      if not ready:
+        time.sleep(_POLL_INTERVAL)
+    return results
+
+  """Aggregates the results of all folds of a model into its scores.
+
+  The classification report is computed over the predictions of all folds.
+  """
+  def _CollectResults(self, model, results, y, folds):
+    if any(result.get('timed_out') for result in results):
+      self._scores[model]['timed_out'] = True
+      self._scores[model]['report'] = 'Timed out and cancelled.'
+      return
+
+    errors = [result['error'] for result in results if 'error' in result]
+    if errors:
+      self._scores[model]['report'] = errors[0]
+      return
+
+    training = [result['training'] for result in results]
+    testing = [result['testing'] for result in results]
+    self._scores[model].update({
+      'training': np.mean(training),
+      'testing': np.mean(testing),
+      'training_std': np.std(training),
+      'testing_std': np.std(testing),
+      'report': classification_report(
+        np.concatenate([_SplitRows(y, fold)[1] for fold in folds]),
+        np.concatenate([result['predicted'] for result in results])),
+    })
+    for metric in _METRICS:
+      self._scores[model][metric] = np.mean(
+        [result[metric] for result in results])
+    self._models[model] = results[0]['model']
 
   def Predict(self, model, X):
-    return self._models[model].predict(X)
+    """Predicts with a model fitted by Run(), scaling X the same way."""
+    return self._models[model].predict(self._scaler.transform(X))
+
+  def GetResults(self):
+    """Returns the scores and _METRICS of each model, without the reports.
+
+    Returns: Dict from model name to a dict of its numeric results, e.g.
+      {'LinearSVC': {'training': 0.9, 'testing': 0.8, 'fit_time': 0.1, ...}}.
+      Models with 'timed_out' or 'skipped' set have no meaningful scores.
+    """
+    return {
+      model: {
+        key: value for key, value in self._scores[model].items()
+        if key != 'report'
+      }
+      for model in self._scores
+    }
 
   def GetReport(self):
     report = '== Classifiers Comparison Report ==\n\n'
+    if self._num_folds is not None:
+      report += 'Scores are mean (+/- stddev) over {} folds.\n\n'.format(
+        self._num_folds)
     for model in self._scores:
       score = self._scores[model]
       report += model + '\n'
-      report += '  Training set score: {:.3f}\n'.format(score['training'])
-      report += '  Testing set score: {:.3f}\n'.format(score['testing'])
+      if score['timed_out']:
+        report += '  Timed out and cancelled.\n\n'
+        continue
+      if score['skipped']:
+        report += '  Skipped, as it needs dense data.\n\n'
+        continue
+      if self._num_folds is None:
+        report += '  Training set score: {:.3f}\n'.format(score['training'])
+        report += '  Testing set score: {:.3f}\n'.format(score['testing'])
+      else:
+        report += '  Training set score: {:.3f} (+/- {:.3f})\n'.format(
+          score['training'], score['training_std'])
+        report += '  Testing set score: {:.3f} (+/- {:.3f})\n'.format(
+          score['testing'], score['testing_std'])
+      report += '  Fit time: {:.3f}s, predict time: {:.3f}s\n'.format(
+        score['fit_time'], score['predict_time'])
+      report += '  Peak RSS delta: {:.1f}MB, model size: {:.1f}KB\n'.format(
+        score['peak_rss_delta'] / 2.0 ** 20, score['model_size'] / 2.0 ** 10)
       report += score['report']
       report += '\n\n'
     return report
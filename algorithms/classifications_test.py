@@ -0,0 +1,169 @@
+import classifications
+
+import numpy as np
+import scipy.sparse
+import time
+import unittest
+import warnings
+
+from sklearn.base import BaseEstimator
+from sklearn.base import ClassifierMixin
+from sklearn.datasets import make_classification
+
+
+def _MakeData():
+  return make_classification(
+    n_samples=120, n_features=6, n_informative=4, random_state=0)
+
+
+# Scores that only depend on the data and the seeds, unlike the _METRICS.
+_SCORES = ['training', 'testing', 'training_std', 'testing_std']
+
+
+class SlowClassifier(BaseEstimator, ClassifierMixin):
+  """Classifier whose fit takes longer than any test budget."""
+
+  def fit(self, X, y):
+    time.sleep(60)
+    return self
+
+
+class FoldCountingClassifiers(classifications.Classifiers):
+  """Records the number of fold results collected per model."""
+
+  def _CollectResults(self, model, results, y, folds):
+    self.num_results = getattr(self, 'num_results', {})
+    self.num_results[model] = len(results)
+    classifications.Classifiers._CollectResults(
+      self, model, results, y, folds)
+
+
+class TestSplitRows(unittest.TestCase):
+  def testSplitRows(self):
+    X = np.arange(12).reshape(6, 2)
+    for fold, expected_test_rows in [
+        ((0, 2), [0, 1]), ((2, 4), [2, 3]), ((4, 6), [4, 5])]:
+      expected_train_rows = [i for i in range(6) if i not in expected_test_rows]
+      for data in [X, scipy.sparse.csr_matrix(X)]:
+        X_train, X_test = classifications._SplitRows(data, fold)
+        if scipy.sparse.issparse(data):
+          X_train, X_test = X_train.toarray(), X_test.toarray()
+        np.testing.assert_array_equal(X[expected_train_rows], X_train)
+        np.testing.assert_array_equal(X[expected_test_rows], X_test)
+
+  def testSharedArrayRoundTrip(self):
+    for array in [np.arange(6.0).reshape(2, 3), np.array([], dtype=int)]:
+      shared = classifications._ToSharedArray(array)
+      np.testing.assert_array_equal(
+        array, classifications._FromSharedArray(shared))
+
+
+class TestClassifiers(unittest.TestCase):
+  def setUp(self):
+    warnings.simplefilter('ignore')
+    self._X, self._y = _MakeData()
+
+  def testExecutorsAgree(self):
+    results = {}
+    for executor in ['sequential', 'thread', 'process']:
+      classifiers = classifications.Classifiers(
+        executor=executor, random_state=7)
+      classifiers.Run(self._X, self._y)
+      results[executor] = classifiers.GetResults()
+
+    for model in results['sequential']:
+      self.assertGreater(results['sequential'][model]['testing'], 0.5, model)
+      for executor in ['thread', 'process']:
+        for score in _SCORES:
+          self.assertEqual(
+            results['sequential'][model][score],
+            results[executor][model][score], (executor, model, score))
+
+  def testCrossValidation(self):
+    classifiers = FoldCountingClassifiers(
+      executor='sequential', num_folds=3)
+    classifiers.Run(self._X, self._y)
+
+    results = classifiers.GetResults()
+    self.assertEqual(
+      {model: 3 for model in results}, classifiers.num_results)
+    self.assertTrue(any(results[model]['testing_std'] > 0 for model in results))
+    report = classifiers.GetReport()
+    self.assertIn('over 3 folds', report)
+    self.assertIn('(+/- ', report)
+
+  def testModelTimeBudgetKillsRun(self):
+    classifiers = classifications.Classifiers(
+      executor='process', model_time_budget=5)
+    classifiers._models['GaussianNB'] = SlowClassifier()
+    start_time = time.time()
+    classifiers.Run(self._X, self._y)
+
+    self.assertLess(time.time() - start_time, 30)
+    results = classifiers.GetResults()
+    self.assertTrue(results['GaussianNB']['timed_out'])
+    self.assertFalse(results['LogisticRegression']['timed_out'])
+    self.assertIn('GaussianNB\n  Timed out and cancelled.',
+                  classifiers.GetReport())
+
+  def testTimeBudgetKillsRun(self):
+    classifiers = classifications.Classifiers(
+      executor='process', time_budget=1)
+    classifiers._models['GaussianNB'] = SlowClassifier()
+    start_time = time.time()
+    classifiers.Run(self._X, self._y)
+
+    self.assertLess(time.time() - start_time, 30)
+    self.assertTrue(classifiers.GetResults()['GaussianNB']['timed_out'])
+
+  def testSparseSkipsDenseOnlyModels(self):
+    for executor in ['sequential', 'process']:
+      classifiers = classifications.Classifiers(executor=executor)
+      classifiers.Run(scipy.sparse.csr_matrix(self._X), self._y)
+
+      results = classifiers.GetResults()
+      for model in results:
+        skipped = model in ['GaussianProcessClassifier', 'GaussianNB']
+        self.assertEqual(skipped, results[model]['skipped'], model)
+        if not skipped:
+          self.assertGreater(results[model]['testing'], 0.5, model)
+      self.assertIn('GaussianNB\n  Skipped', classifiers.GetReport())
+
+
+class TestRerun(unittest.TestCase):
+  def setUp(self):
+    warnings.simplefilter('ignore')
+    self._X, self._y = _MakeData()
+
+  def testTimedOutModelsAreResetByNextRun(self):
+    classifiers = classifications.Classifiers(
+      executor='process', model_time_budget=0.001)
+    classifiers.Run(self._X, self._y)
+    results = classifiers.GetResults()
+    self.assertTrue(any(results[model]['timed_out'] for model in results))
+
+    classifiers._model_time_budget = None
+    classifiers.Run(self._X, self._y)
+    results = classifiers.GetResults()
+    for model in results:
+      self.assertFalse(results[model]['timed_out'], model)
+      self.assertGreater(results[model]['testing'], 0, model)
+    self.assertNotIn('Timed out', classifiers.GetReport())
+
+  def testFailedModelsDropPreviousScores(self):
+    classifiers = classifications.Classifiers(executor='sequential')
+    classifiers.Run(self._X, self._y)
+    self.assertGreater(
+      classifiers.GetResults()['LogisticRegression']['testing'], 0)
+
+    # A single class cannot be fitted by logistic regression.
+    classifiers.Run(self._X, np.zeros_like(self._y))
+    results = classifiers.GetResults()['LogisticRegression']
+    self.assertEqual(0, results['testing'])
+    self.assertEqual(0, results['fit_time'])
+    self.assertTrue(
+      classifiers._scores['LogisticRegression']['report'].startswith('Failed'))
+
+
+if __name__ == '__main__':
+  unittest.main()
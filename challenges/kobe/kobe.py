@@ -11,7 +11,7 @@ from algorithms.classifications import Classifiers
 from utils.csv_parser import CsvParser
 
 def main():
-  parser = CsvParser('data.csv', 'shot_made_flag')
+  parser = CsvParser('data.csv', 'shot_made_flag', cache_dir='.csv_cache')
   data = parser.GetData()
 
   shot_id_index = data['X_schema'].index('shot_id')
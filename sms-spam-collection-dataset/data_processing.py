@@ -1,8 +1,20 @@
 """Utilities to cleans raw Kaggle datasets."""
 
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
-from transformers import GPT2Tokenizer
+from transformers import PreTrainedTokenizerBase
+
+# Number of messages passed to the tokenizer per call.
+TOKENIZE_BATCH_SIZE = 1024
+
+# Tokenizer of the current process pool worker, see `_init_tokenizer_worker`.
+_worker_tokenizer = None
 
 
 def clean_sms_spam_collection_dataset(df: pd.DataFrame) -> pd.DataFrame:
@@ -26,10 +38,152 @@ def clean_sms_spam_collection_dataset(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def tokenize_message(tokenizer: GPT2Tokenizer, df: pd.DataFrame) -> pd.DataFrame:
-    """Widens the input dataframe by tokenizing the messages."""
-    if "tokens" in df.columns:
-        return df
-    df["tokens"] = df["message"].apply(lambda m: tokenizer(m)["input_ids"])
+class RaggedTokens:
+    """Token lists of many messages stored as one flat int32 buffer.
 
-    return df
+    The tokens of message i are `tokens[offsets[i] : offsets[i + 1]]`, so
+    indexing a message returns a view without copying.
+    """
+
+    def __init__(self, tokens: np.ndarray, offsets: np.ndarray):
+        self.tokens = tokens
+        self.offsets = offsets
+
+    @classmethod
+    def from_lists(cls, token_lists: list[list[int]]) -> "RaggedTokens":
+        """Packs token lists (or arrays) into a single flat buffer."""
+        lengths = np.fromiter(
+            map(len, token_lists), dtype=np.int64, count=len(token_lists)
+        )
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        tokens = np.concatenate(
+            [np.asarray(t, dtype=np.int32) for t in token_lists]
+            or [np.empty(0, dtype=np.int32)]
+        )
+        return cls(tokens, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.tokens[self.offsets[i] : self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def lengths(self) -> np.ndarray:
+        """Returns the number of tokens of each message."""
+        return np.diff(self.offsets)
+
+    def take(self, indices: np.ndarray) -> "RaggedTokens":
+        """Returns the messages at `indices` packed into a new buffer."""
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = self.lengths()[indices]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        # Position of each output token in the source buffer: the start of
+        # its message plus its position within the message.
+        starts = np.repeat(self.offsets[indices], lengths)
+        within = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+        return RaggedTokens(self.tokens[starts + within], offsets)
+
+
+def tokenize_message(
+    tokenizer: PreTrainedTokenizerBase,
+    df: pd.DataFrame,
+    cache_path: str | None = None,
+    num_workers: int | None = None,
+) -> RaggedTokens:
+    """Tokenizes the "message" column of the input dataframe.
+
+    Messages are tokenized in batches. Fast (Rust) tokenizers handle a batch in
+    one call; slow Python tokenizers are spread over a process pool.
+
+    Args:
+        tokenizer: The tokenizer to apply to the "message" column.
+        df: The dataframe whose messages to tokenize.
+        cache_path: Optional path of an on-disk token cache. Messages already
+          in the cache are not tokenized again, and new ones are added to it.
+        num_workers: Number of processes used for slow tokenizers. Defaults to
+          the number of CPUs.
+
+    Returns:
+        The tokens of each row of `df`, in row order.
+    """
+    messages = df["message"].to_list()
+    keys = [_message_key(tokenizer, m) for m in messages]
+    cache = _load_token_cache(cache_path) if cache_path else {}
+
+    # Tokenize each distinct message that is not cached yet.
+    missing = {k: m for k, m in zip(keys, messages) if k not in cache}
+    if missing:
+        new_tokens = _tokenize_batches(tokenizer, list(missing.values()), num_workers)
+        cache.update(zip(missing.keys(), new_tokens))
+        if cache_path:
+            _write_token_cache(cache_path, cache)
+
+    return RaggedTokens.from_lists([cache[k] for k in keys])
+
+
+def _message_key(tokenizer: PreTrainedTokenizerBase, message: str) -> str:
+    """Returns the cache key of `message`, which depends on the tokenizer too."""
+    content = f"{tokenizer.name_or_path}\0{message}".encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+def _tokenize_batches(
+    tokenizer: PreTrainedTokenizerBase,
+    messages: list[str],
+    num_workers: int | None,
+) -> list[list[int]]:
+    batches = [
+        messages[i : i + TOKENIZE_BATCH_SIZE]
+        for i in range(0, len(messages), TOKENIZE_BATCH_SIZE)
+    ]
+    if tokenizer.is_fast or num_workers == 1 or len(batches) == 1:
+        results = [tokenizer(batch)["input_ids"] for batch in batches]
+    else:
+        with ProcessPoolExecutor(
+            num_workers,
+            initializer=_init_tokenizer_worker,
+            initargs=(tokenizer,),
+        ) as executor:
+            results = list(executor.map(_tokenize_batch, batches))
+    return [tokens for batch in results for tokens in batch]
+
+
+def _init_tokenizer_worker(tokenizer: PreTrainedTokenizerBase) -> None:
+    # The tokenizer is sent once per worker rather than once per batch.
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _tokenize_batch(messages: list[str]) -> list[list[int]]:
+    return _worker_tokenizer(messages)["input_ids"]
+
+
+def _load_token_cache(cache_path: str) -> dict[str, np.ndarray]:
+    """Loads the token cache as a dict from message key to its tokens."""
+    if not os.path.exists(cache_path):
+        return {}
+    with np.load(cache_path) as cache:
+        keys = cache["keys"]
+        ragged = RaggedTokens(cache["tokens"], cache["offsets"])
+    return {key.decode("ascii"): tokens for key, tokens in zip(keys, ragged)}
+
+
+def _write_token_cache(cache_path: str, cache: dict[str, np.ndarray]) -> None:
+    """Writes the token cache as flat int32 tokens plus per-message offsets."""
+    ragged = RaggedTokens.from_lists(list(cache.values()))
+    keys = np.array([key.encode("ascii") for key in cache], dtype="S64")
+    # Write next to the destination and rename, so readers never see a
+    # partially written cache.
+    directory = os.path.dirname(os.path.abspath(cache_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, keys=keys, tokens=ragged.tokens, offsets=ragged.offsets)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
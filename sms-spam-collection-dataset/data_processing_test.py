@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import data_processing
+
+
+class StubTokenizer:
+    """Tokenizes each word as its length, and counts the tokenized messages."""
+
+    is_fast = True
+    name_or_path = "stub"
+
+    def __init__(self):
+        self.num_tokenized = 0
+
+    def __call__(self, messages: list[str]) -> dict[str, list[list[int]]]:
+        self.num_tokenized += len(messages)
+        return {"input_ids": [[len(w) for w in m.split()] for m in messages]}
+
+
+class TestRaggedTokens(unittest.TestCase):
+    def testFromLists(self):
+        ragged = data_processing.RaggedTokens.from_lists([[1, 2], [], [3]])
+        self.assertEqual(np.int32, ragged.tokens.dtype)
+        np.testing.assert_array_equal([0, 2, 2, 3], ragged.offsets)
+        self.assertEqual([[1, 2], [], [3]], [list(t) for t in ragged])
+        np.testing.assert_array_equal([2, 0, 1], ragged.lengths())
+
+    def testFromEmptyList(self):
+        ragged = data_processing.RaggedTokens.from_lists([])
+        self.assertEqual(0, len(ragged))
+        self.assertEqual(0, len(ragged.tokens))
+
+    def testTakePreservesOrder(self):
+        ragged = data_processing.RaggedTokens.from_lists([[1, 2], [], [3], [4, 5, 6]])
+        taken = ragged.take([3, 1, 0, 3, 2])
+        self.assertEqual(
+            [[4, 5, 6], [], [1, 2], [4, 5, 6], [3]], [list(t) for t in taken]
+        )
+        self.assertEqual(0, len(ragged.take([])))
+        self.assertEqual([[]], [list(t) for t in ragged.take([1])])
+
+
+class TestTokenizeMessage(unittest.TestCase):
+    def testTokenCacheRoundTrip(self):
+        df = pd.DataFrame({"message": ["a bb", "ccc", "a bb", ""]})
+        cache_path = os.path.join(
+            self.enterContext(tempfile.TemporaryDirectory()), "tokens.npz"
+        )
+        tokenizer = StubTokenizer()
+        first = data_processing.tokenize_message(tokenizer, df, cache_path=cache_path)
+        # Duplicate messages are tokenized once.
+        self.assertEqual(3, tokenizer.num_tokenized)
+        self.assertEqual([[1, 2], [3], [1, 2], []], [list(t) for t in first])
+
+        tokenizer = StubTokenizer()
+        second = data_processing.tokenize_message(tokenizer, df, cache_path=cache_path)
+        self.assertEqual(0, tokenizer.num_tokenized)
+        np.testing.assert_array_equal(first.tokens, second.tokens)
+        np.testing.assert_array_equal(first.offsets, second.offsets)
+        self.assertEqual(["tokens.npz"], os.listdir(os.path.dirname(cache_path)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,28 +1,30 @@
-import kagglehub
-from kagglehub import KaggleDatasetAdapter
+import os
+import sys
 
 import naive_bayes
 
-# Load the latest version
-raw_df = kagglehub.load_dataset(
-    KaggleDatasetAdapter.PANDAS,
-    handle="uciml/sms-spam-collection-dataset",
-    path="spam.csv",
-    pandas_kwargs={"encoding": "latin1"},
-    # Provide any additional arguments like
-    # sql_query or pandas_kwargs. See the
-    # documenation for more information:
-    # https://github.com/Kaggle/kagglehub/blob/main/README.md#kaggledatasetadapterpandas
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import dataset_cache
+
+# Downloaded once with kagglehub, then reloaded from a local Parquet cache.
+# Set DATASETS_OFFLINE=1 to never download.
+raw_df = dataset_cache.DatasetCache().LoadTable(
+    "uciml/sms-spam-collection-dataset",
+    "spam.csv",
+    read_csv_kwargs={"encoding": "latin1"},
 )
 
 print("== First 5 records ==\n", raw_df.head())
 
 # Naive Bayes Classifier
-naive_bayes_classifier = naive_bayes.NaiveBayesClassifier(raw_df)
+# Tokens are cached on disk, so re-runs skip tokenizing already-seen messages.
+naive_bayes_classifier = naive_bayes.NaiveBayesClassifier(
+    raw_df, token_cache_path=".token_cache.npz"
+)
 
 print("== First 5 records from NB ==\n", naive_bayes_classifier.df.head())
 
-sample_token = naive_bayes_classifier.df["tokens"].iloc[0]
+sample_token = naive_bayes_classifier.tokens[0]
 
 print(
     'value counts for "label" column:\n',
@@ -31,3 +33,6 @@ print(
 
 print("== STARTING EVALUATION for Naive Bayes Classifier ==")
 naive_bayes_classifier.eval()
+
+# Saved for serving.py, which scores new messages without retraining.
+naive_bayes_classifier.save("naive_bayes_model")
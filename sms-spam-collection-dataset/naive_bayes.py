@@ -1,5 +1,10 @@
 """Implements a Naive Bayes classifier."""
 
+import json
+import os
+import shutil
+import tempfile
+
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import (
     classification_report,
@@ -9,53 +14,242 @@ from sklearn.metrics import (
     recall_score,
     f1_score,
 )
-from transformers import GPT2Tokenizer
+from transformers import GPT2TokenizerFast
 
 import pandas as pd
 import numpy as np
+from scipy import sparse
 import data_processing
 
+# Label order of the rows of the count and log-probability tables.
+LABELS = ("ham", "spam")
+
+# Bumped whenever the layout written by `NaiveBayesClassifier.save` changes.
+_MODEL_FORMAT_VERSION = 1
+
+# Arrays written by `NaiveBayesClassifier.save`, one .npy file each.
+_MODEL_ARRAYS = ("label_counts", "token_counts", "log_priors", "log_token_probs")
+
 
 class NaiveBayesClassifier:
-    def __init__(self, raw_df: pd.DataFrame):
-        self.tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
+    def __init__(
+        self,
+        raw_df: pd.DataFrame | None = None,
+        token_cache_path: str | None = None,
+        tokenizer_name: str = "gpt2",
+        vocab_size: int | None = None,
+    ):
+        """Initializes the classifier, training it on `raw_df` if given.
+
+        Without `raw_df` the model starts empty and is trained incrementally
+        with `partial_fit`. If `token_cache_path` is given, the tokenized
+        messages of `raw_df` are cached on disk there and reused across runs.
+        The tokenizer is loaded on first use; passing `vocab_size` avoids
+        loading it just to size the tables.
+        """
+        self.tokenizer_name = tokenizer_name
+        self._tokenizer = None
+        self.token_cache_path = token_cache_path
+
+        # Dense per-label token counts over the whole tokenizer vocabulary,
+        # indexed as [label, token] with label order given by LABELS.
+        self.vocab_size = len(self.tokenizer) if vocab_size is None else vocab_size
+        self.label_counts = np.zeros(len(LABELS), dtype=np.int64)
+        self.token_counts = np.zeros((len(LABELS), self.vocab_size), dtype=np.int64)
+        self._log_priors = None
+        self._log_token_probs = None
+
+        if raw_df is None:
+            return
 
         self.df = data_processing.clean_sms_spam_collection_dataset(raw_df)
-        self.df = data_processing.tokenize_message(self.tokenizer, self.df)
+        # Tokens of the rows of `df`, kept out of the DataFrame as one flat
+        # buffer instead of an object column of Python lists.
+        self.tokens = data_processing.tokenize_message(
+            self.tokenizer, self.df, cache_path=self.token_cache_path
+        )
 
-        self.X_train, self.X_test, self.y_train, self.y_test = train_test_split(
-            self.df["tokens"],
-            self.df["label"],
+        # Split row positions, then gather the tokens of each side.
+        train_rows, test_rows = train_test_split(
+            np.arange(len(self.df)),
             test_size=0.2,
             random_state=42,
             stratify=self.df["label"],  # labels are imbalanced.
         )
+        self.X_train, self.X_test = (
+            self.tokens.take(train_rows),
+            self.tokens.take(test_rows),
+        )
+        self.y_train, self.y_test = (
+            self.df["label"].iloc[train_rows],
+            self.df["label"].iloc[test_rows],
+        )
+        self._update_counts(self.X_train, self.y_train.to_list())
+
+    @property
+    def tokenizer(self) -> GPT2TokenizerFast:
+        """The tokenizer named `tokenizer_name`, loaded on first access."""
+        if self._tokenizer is None:
+            self._tokenizer = GPT2TokenizerFast.from_pretrained(self.tokenizer_name)
+        return self._tokenizer
+
+    @tokenizer.setter
+    def tokenizer(self, tokenizer: GPT2TokenizerFast) -> None:
+        self._tokenizer = tokenizer
+
+    @property
+    def log_priors(self) -> np.ndarray:
+        """Log P(label), refreshed lazily after the counts change."""
+        if self._log_priors is None:
+            self._refresh_log_tables()
+        return self._log_priors
+
+    @property
+    def log_token_probs(self) -> np.ndarray:
+        """Log P(token|label) as a (len(LABELS), vocab_size) array."""
+        if self._log_token_probs is None:
+            self._refresh_log_tables()
+        return self._log_token_probs
+
+    def partial_fit(self, messages: list[str], labels: list[str]) -> None:
+        """Updates the model with newly labeled messages.
+
+        Only the counts of the new tokens are touched; the log-probability
+        tables are recomputed on the next prediction. The messages bypass the
+        on-disk token cache, which is rewritten whole on every update, so an
+        update costs O(new tokens) rather than O(cache size).
+
+        Args:
+            messages: Raw SMS messages.
+            labels: The label of each message, 'spam' or 'ham'.
+        """
+        tokens = data_processing.tokenize_message(
+            self.tokenizer, pd.DataFrame({"message": list(messages)})
+        )
+        self._update_counts(tokens, list(labels))
+
+    def save(self, path: str) -> None:
+        """Saves the trained model to the directory `path`.
+
+        Each count and log-probability table is written as a .npy file, so
+        `load` can memory-map them, next to a metadata.json naming the
+        tokenizer. The directory is written under a temporary name and renamed
+        into place. A previous model at `path` is first renamed aside and only
+        deleted once the new one is in place, so `path` never holds a partial
+        model.
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        temp_path = tempfile.mkdtemp(dir=parent)
+        old_path = None
+        try:
+            for name in _MODEL_ARRAYS:
+                np.save(os.path.join(temp_path, name + ".npy"), getattr(self, name))
+            metadata = {
+                "version": _MODEL_FORMAT_VERSION,
+                "labels": LABELS,
+                "vocab_size": self.vocab_size,
+                "tokenizer_name": self.tokenizer_name,
+            }
+            with open(os.path.join(temp_path, "metadata.json"), "w") as f:
+                json.dump(metadata, f)
+            if os.path.isdir(path):
+                old_path = tempfile.mkdtemp(dir=parent)
+                os.rename(path, os.path.join(old_path, "model"))
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                if old_path is not None:
+                    # Puts the previous model back.
+                    os.rename(os.path.join(old_path, "model"), path)
+                raise
+        finally:
+            for leftover in (temp_path, old_path):
+                if leftover is not None and os.path.isdir(leftover):
+                    shutil.rmtree(leftover)
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        tokenizer: GPT2TokenizerFast | None = None,
+        mmap_mode: str | None = "r",
+    ) -> "NaiveBayesClassifier":
+        """Loads a classifier written by `save`, ready for prediction.
+
+        The tables are memory-mapped, so loading costs little beyond mapping
+        the files, and the saved log-probability tables are used as is. The
+        tokenizer is only loaded when first needed, unless one is passed in.
+
+        Args:
+            path: The directory written by `save`.
+            tokenizer: Optional already-loaded tokenizer to use.
+            mmap_mode: Passed to `np.load`; None reads the tables into memory.
+
+        Returns:
+            The loaded classifier.
 
-        # Compute label probabilities for the Naive Bayes classifier.
-        self.p_spam = self.y_train.value_counts().get("spam", 0) / len(self.y_train)
+        Raises:
+            ValueError: If the model was saved in another format or with
+                other labels.
+        """
+        with open(os.path.join(path, "metadata.json")) as f:
+            metadata = json.load(f)
+        if metadata.get("version") != _MODEL_FORMAT_VERSION:
+            raise ValueError(
+                f"{path} has model format version {metadata.get('version')}, "
+                f"expected {_MODEL_FORMAT_VERSION}; retrain and save the model."
+            )
+        if tuple(metadata.get("labels", ())) != LABELS:
+            raise ValueError(
+                f"{path} has labels {metadata.get('labels')}, expected {LABELS}."
+            )
 
-        # Compute token probabilities conditioned on labels.
-        self.num_spams, self.num_hams = (
-            self.y_train.value_counts().get("spam", 0),
-            self.y_train.value_counts().get("ham", 0),
+        model = cls(
+            tokenizer_name=metadata["tokenizer_name"],
+            vocab_size=metadata["vocab_size"],
         )
-        self.token_counts_given_spam = self._count_conditional_tokens(
-            self.X_train, self.y_train, label_value="spam"
+        if tokenizer is not None:
+            model.tokenizer = tokenizer
+        load = lambda name: np.load(
+            os.path.join(path, name + ".npy"), mmap_mode=mmap_mode
         )
-        self.token_counts_given_ham = self._count_conditional_tokens(
-            self.X_train, self.y_train, label_value="ham"
+        model.label_counts = load("label_counts")
+        model.token_counts = load("token_counts")
+        model._log_priors = load("log_priors")
+        model._log_token_probs = load("log_token_probs")
+        return model
+
+    def predict_messages(self, messages: list[str]) -> np.ndarray:
+        """Tokenizes raw messages and predicts their labels."""
+        tokens = data_processing.tokenize_message(
+            self.tokenizer, pd.DataFrame({"message": list(messages)})
         )
+        return self.predict_many(tokens)
 
     def predict(self, tokens: list[int]) -> str:
-        """Predicts the labels for the input data ('spam' or 'ham')."""
-        spam_score, ham_score = (
-            self._compute_sum_log_probabilities(tokens, label_value="spam"),
-            self._compute_sum_log_probabilities(tokens, label_value="ham"),
-        )
-        return "spam" if spam_score > ham_score else "ham"
+        """Predicts the label for a single tokenized message ('spam' or 'ham')."""
+        return self.predict_many(data_processing.RaggedTokens.from_lists([tokens]))[0]
+
+    def predict_many(self, tokens: data_processing.RaggedTokens) -> np.ndarray:
+        """Predicts the labels for a batch of tokenized messages.
+
+        All messages are scored with one sparse bag-of-tokens x log-probability
+        matrix product.
+
+        Args:
+            tokens: The tokens of each message.
+
+        Returns:
+            An array of predicted labels, 'spam' or 'ham', one per message.
+        """
+        scores = self._bag_of_tokens(tokens) @ self.log_token_probs.T
+        scores += self.log_priors
+        # argmax picks the first label on ties, so ties resolve to 'ham'.
+        return np.array(LABELS, dtype=object)[scores.argmax(axis=1)]
 
     def eval(self) -> None:
-        predictions = self.X_test.apply(lambda tokens: self.predict(tokens))
+        predictions = self.predict_many(self.X_test)
         print("Classification Report:")
         print(classification_report(self.y_test, predictions))
         print("Confusion Matrix:")
@@ -69,60 +263,46 @@ class NaiveBayesClassifier:
         print("F1 Score:")
         print(f1_score(self.y_test, predictions, pos_label="spam"))
 
-    def _compute_sum_log_probabilities(
-        self, tokens: list[int], label_value: str
-    ) -> float:
-        assert label_value in ("spam", "ham")
-        token_counts_given_label = (
-            self.token_counts_given_spam
-            if label_value == "spam"
-            else self.token_counts_given_ham
-        )
-        p_label = self.p_spam if label_value == "spam" else 1 - self.p_spam
-        token_counts_given_message = (
-            # reindex only retains indexes that match the tokens in message.
-            # fillna(0) assigns 0 probability for unmatched tokens.
-            token_counts_given_label.reindex(tokens).fillna(0)
+    def _bag_of_tokens(self, tokens: data_processing.RaggedTokens) -> sparse.csr_matrix:
+        """Builds a (num_messages, vocab_size) sparse matrix of token counts."""
+        # The flat buffer and offsets are already the CSR indices and indptr.
+        # Repeated tokens within a message are duplicate entries, which the
+        # matrix product sums like an explicit count would.
+        data = np.ones(len(tokens.tokens), dtype=np.float64)
+        return sparse.csr_matrix(
+            (data, tokens.tokens, tokens.offsets),
+            shape=(len(tokens), self.vocab_size),
         )
-        label_probabilities = (
+
+    def _refresh_log_tables(self) -> None:
+        """Recomputes the log-probability tables from the current counts."""
+        self._log_priors = np.log(self.label_counts / self.label_counts.sum())
+        self._log_token_probs = np.log(
             # +1 to num and +vocab_size to denom for Laplace smoothing.
-            (token_counts_given_message + 1)
-            / (token_counts_given_label.sum() + len(self.tokenizer))
-        )
-        sum_log_prob = label_probabilities.apply(lambda p: np.log(p)).sum() + np.log(
-            p_label
+            (self.token_counts + 1)
+            / (self.token_counts.sum(axis=1, keepdims=True) + self.vocab_size)
         )
-        return sum_log_prob
 
-    def _count_conditional_tokens(
-        self, tokens: pd.Series, labels: pd.Series, label_value: str = "spam"
-    ) -> pd.Series:
-        """Counts the frequency of each token conditioned on the given labels.
+    def _update_counts(
+        self, tokens: data_processing.RaggedTokens, labels: list[str]
+    ) -> None:
+        """Adds the tokens of labeled messages to the per-label counts.
 
         Args:
-            tokens: A Series where each value is a list of tokens for a message.
-            labels: A Series of labels corresponding to each message.
-            label_value: The label value to condition on, 'spam' or 'ham'.
-
-        Returns:
-            A Series where the index is the token and the value is the frequency of that token, conditioned on label. Example:
-            ```
-            tokens
-            13     3249
-            345    1384
-            284    1262
-            11     1158
-            314    1153
-            ```
+            tokens: The tokens of each message.
+            labels: The label of each message, 'spam' or 'ham'.
         """
-        #  `tokens[labels == "spam"]``:
-        #    Series, index is row number, value is *list* of tokens. Note
-        #    both X_train and y_train are pd.Series. They share the same
-        #    indexes, which is how we can do boolean indexing with
-        #    `tokens[labels == "spam"]`.
-        #  `tokens[labels == "spam"].explode()``:
-        #    Series, index is row number (may have dups), value is unnested
-        #    *single* token.
-        #  `tokens[labels == 'spam'].explode().value_counts()`:
-        #    Series, index is token, value is frequency of token.
-        return tokens[labels == label_value].explode().value_counts()
+        label_ids = np.array([LABELS.index(label) for label in labels], dtype=np.int64)
+        if not self.token_counts.flags.writeable:
+            # Loaded read-only from disk; further training needs private copies.
+            self.label_counts = np.array(self.label_counts)
+            self.token_counts = np.array(self.token_counts)
+        self.label_counts += np.bincount(label_ids, minlength=len(LABELS))
+        # np.add.at accumulates repeated (label, token) pairs, unlike +=.
+        np.add.at(
+            self.token_counts,
+            (np.repeat(label_ids, tokens.lengths()), tokens.tokens),
+            1,
+        )
+        self._log_priors = None
+        self._log_token_probs = None
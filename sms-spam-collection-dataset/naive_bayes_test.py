@@ -0,0 +1,109 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import data_processing
+import naive_bayes
+
+# Words known to `StubTokenizer`, whose token ids are their positions.
+VOCAB = ("<unk>", "win", "cash", "prize", "now", "hi", "see", "you", "later")
+
+
+class StubTokenizer:
+    """Tokenizes on whitespace over VOCAB, so tests need no downloads."""
+
+    is_fast = True
+    name_or_path = "stub"
+
+    def __len__(self) -> int:
+        return len(VOCAB)
+
+    def _ids(self, message: str) -> list[int]:
+        return [VOCAB.index(w) if w in VOCAB else 0 for w in message.split()]
+
+    def __call__(self, messages: list[str]) -> dict[str, list[list[int]]]:
+        return {"input_ids": [self._ids(m) for m in messages]}
+
+
+MESSAGES = [
+    "win cash now",
+    "hi see you later",
+    "win a prize",
+    "see you",
+    "cash prize now now",
+    "hi you",
+]
+LABELS = ["spam", "ham", "spam", "ham", "spam", "ham"]
+
+
+def make_model() -> naive_bayes.NaiveBayesClassifier:
+    model = naive_bayes.NaiveBayesClassifier(vocab_size=len(VOCAB))
+    model.tokenizer = StubTokenizer()
+    return model
+
+
+class TestNaiveBayesClassifier(unittest.TestCase):
+    def testPredictMany(self):
+        model = make_model()
+        model.partial_fit(MESSAGES, LABELS)
+        tokens = data_processing.RaggedTokens.from_lists(
+            StubTokenizer()(["win cash", "see you later", ""])["input_ids"]
+        )
+        # The empty message is scored by the priors alone, which tie.
+        np.testing.assert_array_equal(
+            ["spam", "ham", "ham"], model.predict_many(tokens)
+        )
+        self.assertEqual("spam", model.predict(StubTokenizer()._ids("prize now")))
+        np.testing.assert_array_equal(
+            model.predict_many(tokens),
+            [model.predict(list(message)) for message in tokens],
+        )
+
+    def testPartialFitInHalvesMatchesOneFit(self):
+        whole = make_model()
+        whole.partial_fit(MESSAGES, LABELS)
+        halves = make_model()
+        halves.partial_fit(MESSAGES[:3], LABELS[:3])
+        # Predicting in between must not freeze the log-probability tables.
+        halves.predict_messages(MESSAGES)
+        halves.partial_fit(MESSAGES[3:], LABELS[3:])
+        np.testing.assert_array_equal(whole.label_counts, halves.label_counts)
+        np.testing.assert_array_equal(whole.token_counts, halves.token_counts)
+        np.testing.assert_array_equal(whole.log_token_probs, halves.log_token_probs)
+
+    def testSaveLoadRoundTrip(self):
+        model = make_model()
+        model.partial_fit(MESSAGES, LABELS)
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "m")
+        model.save(path)
+        # Saving again replaces the model and leaves no temporary directories.
+        model.save(path)
+        self.assertEqual(["m"], os.listdir(os.path.dirname(path)))
+
+        loaded = naive_bayes.NaiveBayesClassifier.load(path, StubTokenizer())
+        self.assertIsInstance(loaded.token_counts, np.memmap)
+        self.assertIsInstance(loaded.log_token_probs, np.memmap)
+        np.testing.assert_array_equal(model.token_counts, loaded.token_counts)
+        queries = ["win now", "see you", "prize", "hello"]
+        np.testing.assert_array_equal(
+            model.predict_messages(queries), loaded.predict_messages(queries)
+        )
+
+    def testLoadRejectsOtherFormatVersion(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "m")
+        make_model().save(path)
+        metadata_path = os.path.join(path, "metadata.json")
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        metadata["version"] += 1
+        with open(metadata_path, "w") as f:
+            json.dump(metadata, f)
+        with self.assertRaises(ValueError):
+            naive_bayes.NaiveBayesClassifier.load(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+"""Serves spam predictions for incoming messages with a warm classifier.
+
+Messages are read one per line, from stdin or from TCP connections, and each
+is answered with its predicted label on its own line. Concurrent requests are
+grouped into micro-batches scored with a single `predict_messages` call.
+
+Usage:
+    python serving.py naive_bayes_model              # stdin / stdout
+    python serving.py naive_bayes_model --port 8765
+"""
+
+import argparse
+import asyncio
+import collections
+import sys
+import time
+
+import numpy as np
+
+import naive_bayes
+
+# Largest number of messages scored together.
+MAX_BATCH_SIZE = 64
+
+# How long the first message of a batch waits for more to arrive.
+MAX_BATCH_DELAY_SECONDS = 0.002
+
+# Number of most recent request latencies kept for the percentiles.
+LATENCY_WINDOW = 100_000
+
+# Answer for messages whose batch failed to be scored.
+ERROR_LABEL = "error"
+
+
+class SpamScoringServer:
+    """Scores messages in micro-batches and records per-request latency."""
+
+    def __init__(
+        self,
+        classifier: naive_bayes.NaiveBayesClassifier,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_batch_delay: float = MAX_BATCH_DELAY_SECONDS,
+    ):
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        # Seconds, one per recently scored message.
+        self.latencies: collections.deque[float] = collections.deque(
+            maxlen=LATENCY_WINDOW
+        )
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def score(self, message: str) -> str:
+        """Returns the label of `message`, 'spam' or 'ham'.
+
+        Raises the classifier's exception if the message's batch fails.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((message, future, time.perf_counter()))
+        return await future
+
+    async def run(self) -> None:
+        """Scores queued messages until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_batch_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            messages, futures, start_times = zip(*batch)
+            try:
+                labels = self.classifier.predict_messages(list(messages))
+            except Exception as error:
+                # Fail this batch's requests only, and keep serving.
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            end_time = time.perf_counter()
+            for future, label, start_time in zip(futures, labels, start_times):
+                self.latencies.append(end_time - start_time)
+                if not future.done():
+                    future.set_result(label)
+
+    def latency_percentiles(self) -> dict[str, float]:
+        """Returns the p50 and p99 latency of recent requests in milliseconds."""
+        if not self.latencies:
+            return {"count": 0, "p50_ms": float("nan"), "p99_ms": float("nan")}
+        p50, p99 = np.percentile(self.latencies, [50, 99]) * 1000
+        return {"count": len(self.latencies), "p50_ms": p50, "p99_ms": p99}
+
+
+async def _answer_lines(server: SpamScoringServer, read_line, write_line) -> None:
+    """Answers each line read with its label, in order.
+
+    Lines are submitted as soon as they are read, so a client that pipelines
+    requests gets them micro-batched. Lines that fail to be scored are
+    answered with ERROR_LABEL.
+    """
+    pending: asyncio.Queue = asyncio.Queue()
+
+    async def write_results():
+        while (task := await pending.get()) is not None:
+            try:
+                label = await task
+            except Exception as error:
+                print(f"Scoring failed: {error!r}", file=sys.stderr)
+                label = ERROR_LABEL
+            await write_line(label)
+
+    writer = asyncio.create_task(write_results())
+    while line := await read_line():
+        message = line.rstrip("\r\n")
+        await pending.put(asyncio.create_task(server.score(message)))
+    await pending.put(None)
+    await writer
+
+
+async def serve_stdin(server: SpamScoringServer) -> None:
+    """Answers messages read from stdin until EOF."""
+    loop = asyncio.get_running_loop()
+
+    async def read_line():
+        return await loop.run_in_executor(None, sys.stdin.readline)
+
+    async def write_line(label):
+        sys.stdout.write(label + "\n")
+        sys.stdout.flush()
+
+    await _answer_lines(server, read_line, write_line)
+
+
+async def serve_tcp(server: SpamScoringServer, host: str, port: int) -> None:
+    """Answers messages sent over TCP connections until cancelled."""
+
+    async def handle_connection(reader, writer):
+        async def read_line():
+            return (await reader.readline()).decode("utf-8")
+
+        async def write_line(label):
+            writer.write(label.encode("utf-8") + b"\n")
+            await writer.drain()
+
+        try:
+            await _answer_lines(server, read_line, write_line)
+        finally:
+            writer.close()
+
+    tcp_server = await asyncio.start_server(handle_connection, host, port)
+    print(f"Listening on {host}:{port}", file=sys.stderr)
+    async with tcp_server:
+        await tcp_server.serve_forever()
+
+
+async def main(args: argparse.Namespace) -> None:
+    classifier = naive_bayes.NaiveBayesClassifier.load(args.model_path)
+    # Load the tokenizer and touch the mapped tables before serving.
+    classifier.predict_messages(["warm up"])
+
+    server = SpamScoringServer(classifier, args.max_batch_size, args.max_batch_delay)
+    scorer = asyncio.create_task(server.run())
+    try:
+        if args.port is None:
+            await serve_stdin(server)
+        else:
+            await serve_tcp(server, args.host, args.port)
+    finally:
+        scorer.cancel()
+        stats = server.latency_percentiles()
+        print(
+            f"Scored {stats['count']} messages, latency "
+            f"p50: {stats['p50_ms']:.3f} ms, p99: {stats['p99_ms']:.3f} ms",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("model_path", help="Model written by NaiveBayesClassifier.save")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="Serve over TCP instead of stdin.")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument(
+        "--max-batch-delay", type=float, default=MAX_BATCH_DELAY_SECONDS
+    )
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
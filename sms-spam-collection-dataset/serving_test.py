@@ -0,0 +1,127 @@
+import asyncio
+import contextlib
+import io
+import socket
+import unittest
+
+import serving
+
+# Seconds to wait for an answer, so that a stuck server fails the test.
+TIMEOUT = 5
+
+
+class StubClassifier:
+    """Labels messages containing 'win' as spam, and fails on 'boom'."""
+
+    def __init__(self):
+        self.batches: list[list[str]] = []
+
+    def predict_messages(self, messages: list[str]) -> list[str]:
+        self.batches.append(messages)
+        if any("boom" in message for message in messages):
+            raise RuntimeError("boom")
+        return ["spam" if "win" in message else "ham" for message in messages]
+
+
+class TestSpamScoringServer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.classifier = StubClassifier()
+        # Silences the server's logs of failed batches.
+        self.enterContext(contextlib.redirect_stderr(io.StringIO()))
+
+    async def start(self, **kwargs) -> serving.SpamScoringServer:
+        server = serving.SpamScoringServer(self.classifier, **kwargs)
+        scorer = asyncio.create_task(server.run())
+        self.addCleanup(scorer.cancel)
+        return server
+
+    async def answer(self, server, lines: list[str]) -> list[str]:
+        """Runs `_answer_lines` over in-memory lines, like a stdin stand-in."""
+        reads = iter(line + "\n" for line in lines)
+        answers = []
+
+        async def read_line():
+            return next(reads, "")
+
+        async def write_line(label):
+            answers.append(label)
+
+        await asyncio.wait_for(
+            serving._answer_lines(server, read_line, write_line), TIMEOUT
+        )
+        return answers
+
+    async def testConcurrentMessagesAreBatched(self):
+        server = await self.start(max_batch_size=4, max_batch_delay=0.05)
+        labels = await asyncio.gather(
+            *(server.score(f"win {i}" if i % 2 else f"hi {i}") for i in range(10))
+        )
+        self.assertEqual(["ham", "spam"] * 5, labels)
+        self.assertEqual([4, 4, 2], [len(batch) for batch in self.classifier.batches])
+        self.assertEqual(10, server.latency_percentiles()["count"])
+
+    async def testAnswersLinesInOrder(self):
+        server = await self.start(max_batch_size=3)
+        messages = [f"win {i}" if i % 3 == 0 else f"hello {i}" for i in range(8)]
+        answers = await self.answer(server, messages)
+        self.assertEqual(["spam" if i % 3 == 0 else "ham" for i in range(8)], answers)
+        self.assertEqual(
+            messages, [m for batch in self.classifier.batches for m in batch]
+        )
+
+    async def testFailedBatchDoesNotStopServing(self):
+        server = await self.start(max_batch_delay=0.05)
+        results = await asyncio.wait_for(
+            asyncio.gather(
+                server.score("hi"), server.score("boom"), return_exceptions=True
+            ),
+            TIMEOUT,
+        )
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual("spam", await asyncio.wait_for(server.score("win"), TIMEOUT))
+
+    async def testFailedLinesAreAnsweredWithError(self):
+        server = await self.start(max_batch_size=1)
+        answers = await self.answer(server, ["win", "boom", "hi"])
+        self.assertEqual(["spam", serving.ERROR_LABEL, "ham"], answers)
+
+    async def testLatenciesAreBounded(self):
+        server = await self.start()
+        self.assertEqual(serving.LATENCY_WINDOW, server.latencies.maxlen)
+
+    async def testServeTcp(self):
+        server = await self.start(max_batch_delay=0.05)
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        tcp = asyncio.create_task(serving.serve_tcp(server, "127.0.0.1", port))
+        self.addCleanup(tcp.cancel)
+        for _ in range(100):
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                break
+            except OSError:
+                await asyncio.sleep(0.01)
+
+        async def exchange(lines: list[str]) -> list[str]:
+            writer.write("".join(line + "\n" for line in lines).encode())
+            await writer.drain()
+            return [
+                (await asyncio.wait_for(reader.readline(), TIMEOUT))
+                .decode()
+                .rstrip("\n")
+                for _ in lines
+            ]
+
+        # Pipelined requests are batched together and answered in order.
+        self.assertEqual(["ham", "spam", "ham"], await exchange(["a", "win", "b"]))
+        self.assertEqual([3], [len(batch) for batch in self.classifier.batches])
+        # A failed batch is answered with errors, and the connection stays up.
+        self.assertEqual([serving.ERROR_LABEL], await exchange(["boom"]))
+        self.assertEqual(["spam"], await exchange(["win"]))
+        writer.close()
+        await writer.wait_closed()
+
+
+if __name__ == "__main__":
+    unittest.main()
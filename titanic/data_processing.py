@@ -1,72 +1,203 @@
-import pandas as pd
+import os
+import sys
+
 import duckdb
+import numpy as np
+import pandas as pd
 import torch
 
 from jaxtyping import Float
 from torch import Tensor
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.profiling import ToRelation
 
-def to_tensors(
-    input_df: pd.DataFrame,
-) -> tuple[Float[Tensor, "batch_size input_dim"], Float[Tensor, "batch_size 1"] | None]:
-    """Transforms the input df into X and y tensors to feed into model.
+
+class FeaturePipeline:
+    """Featurizes passengers with statistics fitted once on the train set.
 
     Thoughts on the data:
     * Certain columns are likely irrelevant, e.g. PassengerId, Name, Ticket, ...
     * Cabin column is intuitively useful, but most are NaN, so we ignore them too.
     * For the rest, we need to one-hot encode the categorical columns. Note the only non-categorical columns are age and fare.
 
+    `fit` learns the Embarked mode, the Age and Fare medians and the categories
+    of each categorical column. `transform` then maps any batch of passengers
+    to the same column layout, so train, test and later batches always agree.
+    Categories unseen in train are encoded like the dropped first category.
+
+    `fit_duckdb` and `transform_duckdb` do the same inside DuckDB, so data
+    read from CSV or Parquet files is featurized without going through pandas.
+    """
+
+    NUMERIC_COLUMNS = ["Age", "Fare"]
+    CATEGORICAL_COLUMNS = ["Pclass", "Sex", "SibSp", "Parch", "Embarked"]
+
+    def __init__(self):
+        self.embarked_mode = None
+        self.medians: dict[str, float] = {}
+        self.categories: dict[str, list] = {}
+
+    def fit(self, train_df: pd.DataFrame) -> "FeaturePipeline":
+        """Learns the imputation statistics and categories from `train_df`."""
+        self.embarked_mode = train_df["Embarked"].mode()[0]
+        embarked = train_df["Embarked"].fillna(self.embarked_mode)
+        self.medians = {
+            column: float(train_df[column].median()) for column in self.NUMERIC_COLUMNS
+        }
+        self.categories = {
+            column: sorted(
+                (embarked if column == "Embarked" else train_df[column])
+                .dropna()
+                .unique()
+                .tolist()
+            )
+            for column in self.CATEGORICAL_COLUMNS
+        }
+        return self
+
+    def fit_duckdb(
+        self, source: pd.DataFrame | str | duckdb.DuckDBPyRelation
+    ) -> "FeaturePipeline":
+        """Like `fit`, with all statistics computed in one DuckDB query.
+
+        Args:
+            source: A DataFrame, the path of a CSV or Parquet file, or a DuckDB
+              relation holding the train set.
+        """
+        aggregates = ["mode(Embarked)"]
+        aggregates += [f'median("{c}")' for c in self.NUMERIC_COLUMNS]
+        aggregates += [
+            f'list_sort(list(DISTINCT "{c}") FILTER (WHERE "{c}" IS NOT NULL))'
+            for c in self.CATEGORICAL_COLUMNS
+        ]
+        row = ToRelation(source).aggregate(", ".join(aggregates)).fetchone()
+        self.embarked_mode = row[0]
+        num_numeric = len(self.NUMERIC_COLUMNS)
+        self.medians = dict(zip(self.NUMERIC_COLUMNS, row[1 : 1 + num_numeric]))
+        self.categories = dict(zip(self.CATEGORICAL_COLUMNS, row[1 + num_numeric :]))
+        return self
+
+    @property
+    def columns(self) -> list[str]:
+        """Names of the feature columns, in tensor column order."""
+        return self.NUMERIC_COLUMNS + [
+            f"{column}_{category}"
+            for column in self.CATEGORICAL_COLUMNS
+            # Drop the first category to avoid multicollinearity.
+            for category in self.categories[column][1:]
+        ]
+
+    def transform(
+        self, input_df: pd.DataFrame
+    ) -> Float[Tensor, "batch_size input_dim"]:
+        """Featurizes `input_df` straight into a float32 tensor.
+
+        Each feature column is written into a preallocated tensor, without
+        intermediate DataFrames, and `input_df` is left unchanged.
+        """
+        X = torch.empty((len(input_df), len(self.columns)), dtype=torch.float32)
+        out = X.numpy()  # Shares memory with X.
+
+        for i, column in enumerate(self.NUMERIC_COLUMNS):
+            out[:, i] = input_df[column].to_numpy(dtype=np.float32, na_value=np.nan)
+            out[np.isnan(out[:, i]), i] = self.medians[column]
+
+        start = len(self.NUMERIC_COLUMNS)
+        for column in self.CATEGORICAL_COLUMNS:
+            values = input_df[column].to_numpy()
+            if column == "Embarked":
+                values = np.where(pd.isna(values), self.embarked_mode, values)
+            categories = self.categories[column][1:]
+            end = start + len(categories)
+            out[:, start:end] = values[:, None] == np.array(categories)[None, :]
+            start = end
+        return X
+
+    def transform_duckdb(
+        self, source: pd.DataFrame | str | duckdb.DuckDBPyRelation
+    ) -> Float[Tensor, "batch_size input_dim"]:
+        """Like `transform`, with imputation and one-hot encoding in DuckDB.
+
+        A single query computes every feature column as FLOAT. DuckDB streams
+        file sources through it and returns each resulting column as its own
+        float32 tensor. Stacking them into the row-major tensor the model
+        expects is then the one full copy of the features.
+        """
+        features = [
+            f'CAST(COALESCE("{c}", {_sql_literal(self.medians[c])}) AS FLOAT) AS "{c}"'
+            for c in self.NUMERIC_COLUMNS
+        ]
+        for column in self.CATEGORICAL_COLUMNS:
+            value = f'"{column}"'
+            if column == "Embarked":
+                value = f"COALESCE({value}, {_sql_literal(self.embarked_mode)})"
+            features += [
+                f"CAST(CASE WHEN {value} = {_sql_literal(category)} THEN 1 ELSE 0 END"
+                f' AS FLOAT) AS "{column}_{category}"'
+                for category in self.categories[column][1:]
+            ]
+        columns = ToRelation(source).project(", ".join(features)).torch()
+        return torch.stack([columns[name] for name in self.columns], dim=1)
+
+    def state_dict(self) -> dict:
+        """Returns the fitted state as plain Python values, to save with the model."""
+        return {
+            "embarked_mode": self.embarked_mode,
+            "medians": self.medians,
+            "categories": self.categories,
+        }
+
+    @classmethod
+    def from_state_dict(cls, state: dict) -> "FeaturePipeline":
+        pipeline = cls()
+        pipeline.embarked_mode = state["embarked_mode"]
+        pipeline.medians = dict(state["medians"])
+        pipeline.categories = {k: list(v) for k, v in state["categories"].items()}
+        return pipeline
+
+
+def _sql_literal(value) -> str:
+    """Formats a category or statistic as a SQL literal."""
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value)
+
+
+def to_tensors(
+    input_df: pd.DataFrame,
+    pipeline: FeaturePipeline | None = None,
+    use_duckdb: bool = False,
+) -> tuple[Float[Tensor, "batch_size input_dim"], Float[Tensor, "batch_size 1"] | None]:
+    """Transforms the input df into X and y tensors to feed into model.
+
     Args:
         input_df: The input dataframe, either the train or test df. For train
           df, column "Survived" must exist; else it's a test df.
+        pipeline: The fitted feature pipeline. If None, one is fitted on
+          `input_df`, which must then be the train df.
+        use_duckdb: Whether to fit and featurize in DuckDB instead of pandas.
 
     Returns:
         A tuple of (X_tensor, y_tensor). If the input df is a test df, then
           y_tensor will be None.
     """
     is_train = "Survived" in input_df.columns
-    input_df["Embarked"] = input_df["Embarked"].fillna(input_df["Embarked"].mode()[0])
-    # Prune the dataset to only include relevant columns.
-    featurized_df = duckdb.sql("""
-    SELECT
-        pclass,
-        sex,
-        age,
-        sibsp,
-        parch,
-        fare,
-        embarked
-    FROM input_df;
-    """).df()
-    # One-hot encode the categorical columns.
-    featurized_df = pd.get_dummies(
-        featurized_df,
-        columns=[
-            "Pclass",
-            "Sex",
-            "SibSp",
-            "Parch",
-            "Embarked",
-        ],
-        drop_first=True,  # Drop the first category to avoid multicollinearity.
-        dtype=float,  # Ensure the one-hot encoded columns are of type float.
+    if pipeline is None:
+        assert is_train, "The feature pipeline must be fitted on the train df."
+        pipeline = FeaturePipeline()
+        if use_duckdb:
+            pipeline.fit_duckdb(input_df)
+        else:
+            pipeline.fit(input_df)
+    X_tensor = (
+        pipeline.transform_duckdb(input_df)
+        if use_duckdb
+        else pipeline.transform(input_df)
     )
-    print(featurized_df.columns)
-
-    # Data cleansing.
-    featurized_df["Age"] = featurized_df["Age"].fillna(featurized_df["Age"].median())
-    featurized_df["Fare"] = featurized_df["Fare"].fillna(featurized_df["Fare"].median())
-
-    # Transform df into  input and output tensors.
-    X = featurized_df.astype("float32")
-    if "Parch_9" not in X.columns:
-        assert (
-            is_train
-        ), "Parch_9 is missing from train data set, so we manually fake the column."
-        X["Parch_9"] = 0
-    y = input_df["Survived"] if is_train else None
-    X_tensor = torch.tensor(X.values, dtype=torch.float32)
     y_tensor = (
-        torch.tensor(y.values, dtype=torch.float32).unsqueeze(1) if is_train else None
+        torch.from_numpy(input_df["Survived"].to_numpy(dtype=np.float32)).unsqueeze(1)
+        if is_train
+        else None
     )
     return X_tensor, y_tensor
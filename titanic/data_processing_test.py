@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import torch
+
+from data_processing import FeaturePipeline, to_tensors
+
+
+def _passengers(**columns) -> pd.DataFrame:
+    df = pd.DataFrame(
+        {
+            "PassengerId": [1, 2, 3, 4, 5, 6],
+            "Pclass": [3, 1, 3, 1, 3, 2],
+            "Sex": ["male", "female", "female", "female", "male", "male"],
+            "Age": [22.0, 38.0, np.nan, 35.0, 35.0, np.nan],
+            "SibSp": [1, 1, 0, 1, 0, 0],
+            "Parch": [0, 0, 0, 0, 0, 2],
+            "Fare": [7.25, 71.2833, 7.925, 53.1, 8.05, 13.0],
+            "Embarked": ["S", "C", "S", None, "S", "Q"],
+        }
+    )
+    for name, values in columns.items():
+        df[name] = values
+    return df
+
+
+class TestFeaturePipeline(unittest.TestCase):
+    def setUp(self):
+        self.train_df = _passengers(Survived=[0, 1, 1, 1, 0, 0])
+        # Unseen categories, and missing values in every imputed column.
+        self.test_df = _passengers(
+            Pclass=[3, 1, 3, 1, 3, 4],
+            SibSp=[8, 1, 0, 1, 0, 0],
+            Parch=[9, 0, 0, 0, 0, 2],
+            Age=[np.nan, 38.0, np.nan, 35.0, 4.0, np.nan],
+            Fare=[7.25, np.nan, 7.925, 53.1, 8.05, 13.0],
+            Embarked=[None, "C", "X", None, "S", "Q"],
+        )
+
+    def testFitDuckdbMatchesFit(self):
+        pipeline = FeaturePipeline().fit(self.train_df)
+        duckdb_pipeline = FeaturePipeline().fit_duckdb(self.train_df)
+        self.assertEqual(pipeline.state_dict(), duckdb_pipeline.state_dict())
+        self.assertEqual("S", pipeline.embarked_mode)
+        self.assertEqual({"Age": 35.0, "Fare": 10.525}, pipeline.medians)
+
+    def testTransformDuckdbMatchesTransform(self):
+        pipeline = FeaturePipeline().fit(self.train_df)
+        for df in [self.train_df, self.test_df]:
+            X = pipeline.transform(df)
+            X_duckdb = pipeline.transform_duckdb(df)
+            self.assertEqual(torch.float32, X_duckdb.dtype)
+            self.assertEqual((len(df), len(pipeline.columns)), X_duckdb.shape)
+            torch.testing.assert_close(X, X_duckdb, rtol=0, atol=0)
+
+    def testMissingAndUnseenValues(self):
+        pipeline = FeaturePipeline().fit(self.train_df)
+        X = pipeline.transform_duckdb(self.test_df)
+        features = pd.DataFrame(X.numpy(), columns=pipeline.columns)
+        np.testing.assert_array_equal(
+            [35.0, 38.0, 35.0, 35.0, 4.0, 35.0], features["Age"]
+        )
+        self.assertAlmostEqual(10.525, features["Fare"][1], places=5)
+        # Missing Embarked is imputed with the train mode "S", and unseen "X"
+        # is encoded like the dropped first category "C".
+        embarked = features[["Embarked_Q", "Embarked_S"]].to_numpy()
+        np.testing.assert_array_equal([1, 0, 0, 1, 1, 0], embarked[:, 1])
+        np.testing.assert_array_equal([0, 0, 0, 0, 0, 1], embarked[:, 0])
+        # Unseen Pclass 4, SibSp 8 and Parch 9 are all zeros.
+        self.assertNotIn("Parch_9", pipeline.columns)
+        np.testing.assert_array_equal(
+            [0, 0], features[["Pclass_2", "Pclass_3"]].to_numpy()[5]
+        )
+        np.testing.assert_array_equal(0, features["SibSp_1"][0])
+
+    def testTransformDuckdbFromFile(self):
+        pipeline = FeaturePipeline().fit(self.train_df)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "test.csv")
+            self.test_df.to_csv(path, index=False)
+            torch.testing.assert_close(
+                pipeline.transform(self.test_df),
+                pipeline.transform_duckdb(path),
+                rtol=0,
+                atol=0,
+            )
+
+    def testToTensors(self):
+        X, y = to_tensors(self.train_df)
+        X_duckdb, y_duckdb = to_tensors(self.train_df, use_duckdb=True)
+        torch.testing.assert_close(X, X_duckdb, rtol=0, atol=0)
+        torch.testing.assert_close(y, y_duckdb)
+        self.assertEqual((6, 1), y.shape)
+        _, y_test = to_tensors(self.test_df, FeaturePipeline().fit(self.train_df))
+        self.assertIsNone(y_test)
+
+    def testStateDictRoundTrip(self):
+        pipeline = FeaturePipeline().fit(self.train_df)
+        restored = FeaturePipeline.from_state_dict(pipeline.state_dict())
+        torch.testing.assert_close(
+            pipeline.transform(self.test_df), restored.transform(self.test_df)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
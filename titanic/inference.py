@@ -0,0 +1,121 @@
+"""Batched inference with a trained SurvivalModel checkpoint.
+
+Usage:
+    python inference.py best_model.pt test.csv submission.csv
+"""
+
+import argparse
+import csv
+from typing import Iterable, Iterator
+
+import pandas as pd
+import torch
+
+from jaxtyping import Float
+from torch import Tensor
+
+from data_processing import FeaturePipeline
+from training import SurvivalModel
+
+# Number of rows scored per forward pass.
+BATCH_SIZE = 4096
+
+# Number of CSV rows read and featurized at a time.
+CHUNK_SIZE = 100_000
+
+
+def load_checkpoint(checkpoint_path: str) -> tuple[SurvivalModel, FeaturePipeline]:
+    """Loads the model and feature pipeline saved by main.py.
+
+    Raises:
+        ValueError: If the checkpoint predates the saved feature pipeline. Its
+          model expects the old column layout, so it must be rebuilt by
+          running main.py.
+    """
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    if "feature_pipeline" not in checkpoint:
+        raise ValueError(
+            f"{checkpoint_path} has no feature pipeline, as it was saved by an "
+            "older main.py for a different feature layout. Rebuild it by "
+            "running main.py."
+        )
+    state_dict = checkpoint["model_state_dict"]
+    # The input dim is not stored separately; the first layer's weight is
+    # (hidden_dim, input_dim).
+    input_dim = state_dict["net.0.weight"].shape[1]
+    model = SurvivalModel(input_dim, checkpoint["best_params"]["hidden_dim"])
+    model.load_state_dict(state_dict)
+    model.eval()
+    pipeline = FeaturePipeline.from_state_dict(checkpoint["feature_pipeline"])
+    return model, pipeline
+
+
+def export_model(model: torch.nn.Module, input_dim: int, path: str) -> None:
+    """Saves the model traced to TorchScript, loadable with `torch.jit.load`
+    without the Python model definition."""
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.zeros(1, input_dim))
+    traced.save(path)
+
+
+def predict_batches(
+    model: torch.nn.Module,
+    X: Float[Tensor, "num_rows input_dim"],
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[Float[Tensor, "batch_size 1"]]:
+    """Yields the survival probabilities of X, `batch_size` rows at a time."""
+    with torch.inference_mode():
+        for start in range(0, len(X), batch_size):
+            yield model(X[start : start + batch_size])
+
+
+def write_submission(
+    model: torch.nn.Module,
+    pipeline: FeaturePipeline,
+    passenger_chunks: Iterable[pd.DataFrame],
+    path: str,
+    batch_size: int = BATCH_SIZE,
+) -> None:
+    """Writes a Kaggle submission CSV for chunks of passengers.
+
+    Each chunk is featurized with the fitted pipeline and its predictions are
+    written batch by batch, so memory is bounded by the chunk size.
+    """
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["PassengerId", "Survived"])
+        for chunk in passenger_chunks:
+            X = pipeline.transform(chunk)
+            ids = chunk["PassengerId"].tolist()
+            start = 0
+            for outputs in predict_batches(model, X, batch_size):
+                predictions = (outputs >= 0.5).squeeze(1).int().tolist()
+                writer.writerows(
+                    zip(ids[start : start + len(predictions)], predictions)
+                )
+                start += len(predictions)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes a Titanic submission.")
+    parser.add_argument("checkpoint", help="Checkpoint written by main.py.")
+    parser.add_argument("input_csv", help="Passengers to score, like test.csv.")
+    parser.add_argument("output_csv", help="Where to write the submission.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--threads", type=int, help="Torch intra-op threads.")
+    parser.add_argument("--export", help="Also save a traced TorchScript model.")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    model, pipeline = load_checkpoint(args.checkpoint)
+    if args.export:
+        export_model(model, len(pipeline.columns), args.export)
+    write_submission(
+        model,
+        pipeline,
+        pd.read_csv(args.input_csv, chunksize=args.chunk_size),
+        args.output_csv,
+        args.batch_size,
+    )
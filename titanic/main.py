@@ -1,19 +1,21 @@
-import kagglehub
-
-import pandas as pd
 import os
-import duckdb
+import sys
 import torch
 
-from data_processing import to_tensors
+from data_processing import FeaturePipeline, to_tensors
 from sklearn.model_selection import train_test_split
+from inference import load_checkpoint, write_submission
 from training import HyperparameterTuner, SurvivalModel, Trainer
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import dataset_cache, profiling
+
 NUM_EPOCHS = 1000
 
-path = kagglehub.competition_download("titanic")
-train_df = pd.read_csv(os.path.join(path, "train.csv"))
-test_df = pd.read_csv(os.path.join(path, "test.csv"))
+# Downloaded once, then reloaded from a local Parquet cache (also offline).
+kaggle_datasets = dataset_cache.DatasetCache()
+train_df = kaggle_datasets.LoadTable("titanic", "train.csv", competition=True)
+test_df = kaggle_datasets.LoadTable("titanic", "test.csv", competition=True)
 
 
 #
@@ -24,44 +26,20 @@ test_df = pd.read_csv(os.path.join(path, "test.csv"))
 # print(test_df.shape)  # (418, 11)
 print(train_df.head())
 
-survival_counts = duckdb.sql("""
-SELECT Survived, COUNT(*) AS count FROM train_df GROUP BY ALL;
-""").df()
-print(survival_counts)
-
-pclass_counts = duckdb.sql("""
-SELECT Pclass, COUNT(*) AS count FROM train_df GROUP BY ALL;
-""").df()
-print(pclass_counts)
-
-sex_counts = duckdb.sql("""
-SELECT Sex, COUNT(*) AS count FROM train_df GROUP BY ALL;
-""").df()
-print(sex_counts)
-
-age_distribution = duckdb.sql("""
-SELECT
-    approx_quantile(AGE, 0.10) AS p10_age,
-    approx_quantile(AGE, 0.20) AS p20_age,
-    approx_quantile(AGE, 0.30) AS p30_age,
-    approx_quantile(AGE, 0.40) AS p40_age,
-    approx_quantile(AGE, 0.50) AS p50_age,
-    approx_quantile(AGE, 0.60) AS p60_age,
-    approx_quantile(AGE, 0.70) AS p70_age,
-    approx_quantile(AGE, 0.80) AS p80_age,
-    approx_quantile(AGE, 0.90) AS p90_age,
-    approx_quantile(AGE, 0.99) AS p99_age
-FROM train_df;
-""").df()
-print(age_distribution)
-
-cabin_counts = duckdb.sql("""
-SELECT Cabin, COUNT(*) AS count FROM train_df GROUP BY ALL order by count DESC;
-""").df()
-print(cabin_counts)
-
-
-X_train, y_train = to_tensors(train_df)
+# One cached DuckDB pass profiles every column: survival, class and sex
+# counts, age quantiles, cabin frequencies, null rates, ...
+print(
+    profiling.FormatProfile(
+        profiling.ProfileTable(train_df, cache_dir=".profile_cache")
+    )
+)
+
+
+# Imputation statistics and categories are learned on train only, and saved
+# with the model so test and later batches get the same column layout.
+feature_pipeline = FeaturePipeline().fit(train_df)
+print(feature_pipeline.columns)
+X_train, y_train = to_tensors(train_df, feature_pipeline)
 
 X_tr, X_val, y_tr, y_val = train_test_split(
     X_train,
@@ -72,7 +50,7 @@ X_tr, X_val, y_tr, y_val = train_test_split(
 )
 
 tuner = HyperparameterTuner(X_tr, y_tr, X_val, y_val)
-tuner.tune()
+tuner.tune(n_jobs=os.cpu_count())
 
 model = SurvivalModel(X_train.shape[1], tuner.best_params["hidden_dim"])
 trainer = Trainer(model, tuner.best_params["lr"])
@@ -82,6 +60,7 @@ torch.save(
     {
         "model_state_dict": model.state_dict(),
         "best_params": tuner.best_params,
+        "feature_pipeline": feature_pipeline.state_dict(),
         "f1": f1,
         "accuracy": accuracy,
         "losses": losses,
@@ -100,20 +79,10 @@ plt.savefig("training_loss_curve.png")
 plt.close()
 
 
-# Now run inference against test set.
+# Now run inference against test set, from the saved checkpoint.
 print("sample test df:")
 print(test_df.head())
-X_test, _ = to_tensors(test_df)
-with torch.no_grad():
-    print(X_train.shape)
-    print(X_test.shape)
-    test_outputs = model(X_test)
-    test_predictions = (test_outputs >= 0.5).float()
-    # Save the predictions to a CSV file for submission.
-    submission_df = pd.DataFrame(
-        {
-            "PassengerId": test_df["PassengerId"],
-            "Survived": test_predictions.squeeze().int().tolist(),
-        }
-    )
-    submission_df.to_csv("submission.csv", index=False)
+print(X_train.shape)
+best_model, best_pipeline = load_checkpoint("best_model.pt")
+# Save the predictions to a CSV file for submission.
+write_submission(best_model, best_pipeline, [test_df], "submission.csv")
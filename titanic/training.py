@@ -2,13 +2,40 @@
 
 from sklearn.metrics import f1_score
 
+import collections
+import copy
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
 import optuna
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import tqdm
+from optuna.storages.journal import JournalFileBackend, JournalStorage
+from optuna.study import MaxTrialsCallback
+from torch.utils.data import BatchSampler, DataLoader, RandomSampler, TensorDataset
 
 NUM_EPOCHS = 1000
 
+# Validate every EVAL_EVERY epochs, and stop after PATIENCE validations in a
+# row without the validation loss improving by at least MIN_IMPROVEMENT.
+EVAL_EVERY = 10
+PATIENCE = 10
+MIN_IMPROVEMENT = 1e-4
+
+N_TRIALS = 100
+
+# Number of trials trained together by HyperparameterTuner.tune_population.
+POPULATION_SIZE = 20
+
+# torch.optim.Adam defaults, used by PopulationTrainer's stacked Adam.
+ADAM_BETAS = (0.9, 0.999)
+ADAM_EPS = 1e-8
+
 
 class SurvivalModel(nn.Module):
     """A simple feedforward neural network for binary classification."""
@@ -26,25 +53,142 @@ class SurvivalModel(nn.Module):
         return self.net(x)
 
 
+class StackedSurvivalModels(nn.Module):
+    """Several SurvivalModels with stacked weights, run as batched matmuls.
+
+    Model i uses the first `hidden_dims[i]` units of a hidden layer of size
+    `max(hidden_dims)`, so models with different hidden dims share one set of
+    stacked tensors. The weights of the remaining units start at zero, and
+    their gradients are exactly zero, so they never affect the model.
+    """
+
+    def __init__(self, input_dim, hidden_dims: list[int]):
+        super(StackedSurvivalModels, self).__init__()
+        self.hidden_dims = list(hidden_dims)
+        n, h = len(hidden_dims), max(hidden_dims)
+        self.w1 = nn.Parameter(torch.zeros(n, input_dim, h))
+        self.b1 = nn.Parameter(torch.zeros(n, 1, h))
+        self.w2 = nn.Parameter(torch.zeros(n, h, 1))
+        self.b2 = nn.Parameter(torch.zeros(n, 1, 1))
+        # Initialize each model exactly like a standalone SurvivalModel.
+        with torch.no_grad():
+            for i, hidden_dim in enumerate(hidden_dims):
+                layer1, _, layer2, _ = SurvivalModel(input_dim, hidden_dim).net
+                self.w1[i, :, :hidden_dim] = layer1.weight.T
+                self.b1[i, 0, :hidden_dim] = layer1.bias
+                self.w2[i, :hidden_dim, 0] = layer2.weight[0]
+                self.b2[i, 0, 0] = layer2.bias[0]
+
+    def forward(self, x):
+        """Maps (batch_size, input_dim) inputs to (num_models, batch_size, 1)."""
+        x = x.expand(len(self.hidden_dims), *x.shape)
+        hidden = torch.relu(torch.baddbmm(self.b1, x, self.w1))
+        return torch.sigmoid(torch.baddbmm(self.b2, hidden, self.w2))
+
+    def to_model(self, i: int) -> SurvivalModel:
+        """Returns model i as a standalone SurvivalModel."""
+        hidden_dim = self.hidden_dims[i]
+        model = SurvivalModel(self.w1.shape[1], hidden_dim)
+        layer1, _, layer2, _ = model.net
+        with torch.no_grad():
+            layer1.weight.copy_(self.w1[i, :, :hidden_dim].T)
+            layer1.bias.copy_(self.b1[i, 0, :hidden_dim])
+            layer2.weight.copy_(self.w2[i, :hidden_dim, 0].unsqueeze(0))
+            layer2.bias.copy_(self.b2[i, 0])
+        return model
+
+
 class Trainer:
-    """Trainer class to handle the training loop."""
+    """Trainer class to handle the training loop.
 
-    def __init__(self, model, lr):
+    By default each epoch is one full-batch gradient step. With `batch_size`
+    set, each epoch instead takes one step per shuffled mini-batch, so the
+    training data no longer has to fit in a single forward pass.
+
+    The validation loss is checked every `eval_every` epochs. Training stops
+    early once it has not improved for `patience` checks (never if `patience`
+    is None), and the model is left with the best weights seen. When training
+    for an Optuna trial, the validation accuracy of each check is reported to
+    the trial, and the trial's pruner may stop it.
+    """
+
+    def __init__(
+        self,
+        model,
+        lr,
+        batch_size: int | None = None,
+        num_workers: int = 0,
+        num_epochs: int = NUM_EPOCHS,
+        eval_every: int = EVAL_EVERY,
+        patience: int | None = PATIENCE,
+    ):
         self.model = model
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr=lr)
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.num_epochs = num_epochs
+        self.eval_every = eval_every
+        self.patience = patience
+        # Filled in by train().
+        self.epochs_run = 0
+        self.best_epoch = 0
+        self.time_saved = 0.0
 
-    def train(self, X_tr, y_tr, X_val, y_val):
+    def train(self, X_tr, y_tr, X_val, y_val, trial: optuna.Trial | None = None):
         loss_fn = nn.BCELoss()
 
         losses: list[float] = []  # for plotting.
-        for _ in tqdm.tqdm(range(NUM_EPOCHS), desc="Training"):
-            self.optimizer.zero_grad()
-            outputs = self.model(X_tr)
-            loss = loss_fn(outputs, y_tr)
-            loss.backward()
-            self.optimizer.step()
+        batches = self._batches(X_tr, y_tr)
+        best_val_loss, best_state = float("inf"), None
+        checks_without_improvement = 0
+        start_time = time.perf_counter()
+        for epoch in tqdm.tqdm(range(self.num_epochs), desc="Training"):
+            epoch_loss, num_examples = 0.0, 0
+            for X_batch, y_batch in batches:
+                self.optimizer.zero_grad()
+                outputs = self.model(X_batch)
+                loss = loss_fn(outputs, y_batch)
+                loss.backward()
+                self.optimizer.step()
+
+                epoch_loss += loss.item() * len(X_batch)
+                num_examples += len(X_batch)
+
+            losses.append(epoch_loss / num_examples)
+            self.epochs_run = epoch + 1
 
-            losses.append(loss.item())
+            if self.epochs_run % self.eval_every:
+                continue
+            with torch.no_grad():
+                val_outputs = self.model(X_val)
+                val_loss = loss_fn(val_outputs, y_val).item()
+            if trial is not None:
+                val_accuracy = ((val_outputs >= 0.5).float() == y_val).float().mean()
+                trial.report(val_accuracy.item(), step=self.epochs_run)
+                if trial.should_prune():
+                    raise optuna.TrialPruned()
+            if val_loss < best_val_loss - MIN_IMPROVEMENT:
+                best_val_loss, self.best_epoch = val_loss, self.epochs_run
+                # Copied, since the live state dict tensors keep training.
+                best_state = copy.deepcopy(self.model.state_dict())
+                checks_without_improvement = 0
+            else:
+                checks_without_improvement += 1
+                if self.patience is not None and (
+                    checks_without_improvement >= self.patience
+                ):
+                    break
+
+        elapsed = time.perf_counter() - start_time
+        self.time_saved = (
+            elapsed / self.epochs_run * (self.num_epochs - self.epochs_run)
+        )
+        print(
+            f"Ran {self.epochs_run}/{self.num_epochs} epochs "
+            f"(best at epoch {self.best_epoch}), saving ~{self.time_saved:.1f}s"
+        )
+        if best_state is not None:
+            self.model.load_state_dict(best_state)
 
         with torch.no_grad():
             preds = (self.model(X_val) >= 0.5).float()
@@ -53,6 +197,123 @@ class Trainer:
 
         return f1, accuracy, losses
 
+    def _batches(self, X, y):
+        """Returns an iterable over the (X, y) batches of one epoch."""
+        if self.batch_size is None:
+            return [(X, y)]
+        dataset = TensorDataset(X.contiguous(), y.contiguous())
+        # Sampling whole batches of indices lets TensorDataset gather each
+        # batch with one indexing op instead of collating single rows.
+        sampler = BatchSampler(
+            RandomSampler(dataset), batch_size=self.batch_size, drop_last=False
+        )
+        return DataLoader(
+            dataset,
+            sampler=sampler,
+            batch_size=None,
+            num_workers=self.num_workers,
+            pin_memory=torch.cuda.is_available(),
+            persistent_workers=self.num_workers > 0,
+        )
+
+
+class PopulationTrainer:
+    """Trains all models of a StackedSurvivalModels at once.
+
+    Each optimizer step advances every model: the forward pass is batched over
+    the stacked weights, and Adam is applied elementwise with a per-model
+    learning rate, matching what `Trainer` does for each model alone. Early
+    stopping is tracked per model: a stopped model is no longer updated while
+    the others keep training, and every model ends with its best weights.
+    """
+
+    def __init__(
+        self,
+        models: StackedSurvivalModels,
+        lrs: list[float],
+        num_epochs: int = NUM_EPOCHS,
+        eval_every: int = EVAL_EVERY,
+        patience: int | None = PATIENCE,
+    ):
+        self.models = models
+        self.lrs = torch.tensor(lrs, dtype=torch.float32).view(-1, 1, 1)
+        self.num_epochs = num_epochs
+        self.eval_every = eval_every
+        self.patience = patience
+        self.params = list(models.parameters())
+        self._exp_avgs = [torch.zeros_like(p) for p in self.params]
+        self._exp_avg_sqs = [torch.zeros_like(p) for p in self.params]
+        self._steps = 0
+        # Filled in by train(), one entry per model.
+        self.epochs_run = torch.zeros(len(lrs), dtype=torch.long)
+        self.best_epochs = torch.zeros(len(lrs), dtype=torch.long)
+
+    def train(self, X_tr, y_tr, X_val, y_val) -> tuple[list[float], list[float]]:
+        """Trains the models and returns the validation F1s and accuracies."""
+        num_models = len(self.lrs)
+        best_val_losses = torch.full((num_models,), float("inf"))
+        best_params = [p.detach().clone() for p in self.params]
+        checks_without_improvement = torch.zeros(num_models, dtype=torch.long)
+        active = torch.ones(num_models, dtype=torch.bool)
+
+        for epoch in tqdm.tqdm(range(self.num_epochs), desc="Training population"):
+            for p in self.params:
+                p.grad = None
+            # Summing the per-model losses keeps each model's gradient
+            # independent of the others.
+            self._losses(X_tr, y_tr).sum().backward()
+            self._adam_step(active)
+            self.epochs_run[active] = epoch + 1
+
+            if (epoch + 1) % self.eval_every:
+                continue
+            with torch.no_grad():
+                val_losses = self._losses(X_val, y_val)
+            improved = active & (val_losses < best_val_losses - MIN_IMPROVEMENT)
+            best_val_losses[improved] = val_losses[improved]
+            self.best_epochs[improved] = epoch + 1
+            for p, best in zip(self.params, best_params):
+                best[improved] = p.detach()[improved]
+            checks_without_improvement[improved] = 0
+            checks_without_improvement[active & ~improved] += 1
+            if self.patience is not None:
+                active &= checks_without_improvement < self.patience
+                if not active.any():
+                    break
+
+        with torch.no_grad():
+            for p, best in zip(self.params, best_params):
+                # Models never validated keep their final weights.
+                validated = self.best_epochs > 0
+                p[validated] = best[validated]
+            preds = (self.models(X_val) >= 0.5).float()
+        accuracies = (preds == y_val).float().mean(dim=(1, 2)).tolist()
+        f1s = [
+            f1_score(y_val.squeeze().numpy(), model_preds.squeeze().numpy())
+            for model_preds in preds
+        ]
+        return f1s, accuracies
+
+    def _losses(self, X, y):
+        """Returns the (num_models,) mean BCE loss of each model."""
+        outputs = self.models(X)
+        losses = F.binary_cross_entropy(outputs, y.expand_as(outputs), reduction="none")
+        return losses.mean(dim=(1, 2))
+
+    @torch.no_grad()
+    def _adam_step(self, active):
+        """Applies one Adam update to the models that are still active."""
+        self._steps += 1
+        beta1, beta2 = ADAM_BETAS
+        step_sizes = self.lrs * active.view(-1, 1, 1) / (1 - beta1**self._steps)
+        for p, exp_avg, exp_avg_sq in zip(
+            self.params, self._exp_avgs, self._exp_avg_sqs
+        ):
+            exp_avg.lerp_(p.grad, 1 - beta1)
+            exp_avg_sq.mul_(beta2).addcmul_(p.grad, p.grad, value=1 - beta2)
+            denom = (exp_avg_sq / (1 - beta2**self._steps)).sqrt_().add_(ADAM_EPS)
+            p.sub_(step_sizes * exp_avg / denom)
+
 
 class HyperparameterTuner:
     """Hyperparameter tuning with Optuna."""
@@ -65,16 +326,154 @@ class HyperparameterTuner:
         self.best_params = None
 
     def objective(self, trial: optuna.Trial) -> float:
-        hidden_dim = trial.suggest_int("hidden_dim", 8, 128, log=True)
-        lr = trial.suggest_float("lr", 1e-5, 1e-1, log=True)
+        hidden_dim, lr = self._suggest(trial)
         model = SurvivalModel(self.X_tr.shape[1], hidden_dim)
         trainer = Trainer(model, lr)
-        f1, accuracy, _ = trainer.train(self.X_tr, self.y_tr, self.X_val, self.y_val)
+        f1, accuracy, _ = trainer.train(
+            self.X_tr, self.y_tr, self.X_val, self.y_val, trial=trial
+        )
         return accuracy
 
-    def tune(self):
+    def tune(
+        self,
+        n_trials: int = N_TRIALS,
+        n_jobs: int = 1,
+        storage: str | None = None,
+        study_name: str = "titanic",
+        pruner: optuna.pruners.BasePruner | None = None,
+    ):
+        """Searches hyperparameters until the study has `n_trials` trials.
+
+        Args:
+            n_trials: Total number of trials in the study, including any that
+              already exist in `storage`.
+            n_jobs: Number of processes running trials in parallel. They share
+              the study through `storage`.
+            storage: A database URL such as "sqlite:///tuning.db", or the path
+              of an Optuna journal file. Defaults to an in-memory study, or a
+              temporary journal file when `n_jobs` > 1.
+            study_name: Name of the study, to resume it from `storage`.
+            pruner: Pruner stopping unpromising trials early. Defaults to a
+              median pruner.
+        """
+        if pruner is None:
+            pruner = optuna.pruners.MedianPruner(
+                n_startup_trials=5, n_warmup_steps=5 * EVAL_EVERY
+            )
+        temp_dir = None
+        if storage is None and n_jobs > 1:
+            temp_dir = tempfile.mkdtemp()
+            storage = os.path.join(temp_dir, "journal.log")
+
+        try:
+            study = optuna.create_study(
+                direction="maximize",
+                pruner=pruner,
+                storage=_open_storage(storage),
+                study_name=study_name,
+                load_if_exists=True,
+            )
+            if n_jobs == 1:
+                _run_trials(self, study, n_trials)
+            else:
+                # Forked rather than spawned, so workers inherit the tensors
+                # and main.py is not re-imported in each of them.
+                context = multiprocessing.get_context("fork")
+                workers = [
+                    context.Process(
+                        target=_tune_worker,
+                        args=(self, storage, study_name, pruner, n_trials),
+                    )
+                    for _ in range(n_jobs)
+                ]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                failed = [w.exitcode for w in workers if w.exitcode != 0]
+                assert not failed, f"Tuning workers failed: {failed}"
+
+            print("Best value: ", study.best_value)
+            print("Best hyperparameters: ", study.best_params)
+            self.best_params = study.best_params
+        finally:
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir)
+
+    def tune_population(
+        self, n_trials: int = N_TRIALS, population_size: int = POPULATION_SIZE
+    ):
+        """Searches hyperparameters, training trials in vectorized populations.
+
+        Instead of one model per trial, `population_size` trials are asked
+        from the study at a time and trained together as StackedSurvivalModels,
+        so each optimizer step advances many of them. Trials are stacked with
+        others whose hidden dim has the same power of two, which bounds the
+        padding of the stacked hidden layer to 2x.
+        """
         study = optuna.create_study(direction="maximize")
-        study.optimize(self.objective, n_trials=100)
+        while len(study.trials) < n_trials:
+            size = min(population_size, n_trials - len(study.trials))
+            trials = [study.ask() for _ in range(size)]
+            buckets = collections.defaultdict(list)
+            for trial in trials:
+                hidden_dim, lr = self._suggest(trial)
+                buckets[hidden_dim.bit_length()].append((trial, hidden_dim, lr))
+
+            for bucket in buckets.values():
+                bucket_trials, hidden_dims, lrs = zip(*bucket)
+                models = StackedSurvivalModels(self.X_tr.shape[1], hidden_dims)
+                trainer = PopulationTrainer(models, lrs)
+                _, accuracies = trainer.train(
+                    self.X_tr, self.y_tr, self.X_val, self.y_val
+                )
+                for trial, accuracy in zip(bucket_trials, accuracies):
+                    study.tell(trial, accuracy)
+
         print("Best value: ", study.best_value)
         print("Best hyperparameters: ", study.best_params)
         self.best_params = study.best_params
+
+    def _suggest(self, trial: optuna.Trial) -> tuple[int, float]:
+        """Samples the (hidden_dim, lr) of a trial."""
+        hidden_dim = trial.suggest_int("hidden_dim", 8, 128, log=True)
+        lr = trial.suggest_float("lr", 1e-5, 1e-1, log=True)
+        return hidden_dim, lr
+
+
+def _open_storage(storage: str | None):
+    """Returns the Optuna storage for a database URL or a journal file path."""
+    if storage is None or "://" in storage:
+        return storage
+    return JournalStorage(JournalFileBackend(storage))
+
+
+def _run_trials(tuner: HyperparameterTuner, study: optuna.Study, n_trials: int) -> None:
+    # Counting every trial in the study, whichever process runs it, keeps the
+    # total at n_trials however many workers share it. Trials left from an
+    # earlier run of a persistent study count too, so a resumed study only
+    # runs the rest, and a complete one runs none.
+    remaining = n_trials - len(study.trials)
+    if remaining <= 0:
+        return
+    study.optimize(
+        tuner.objective,
+        n_trials=remaining,
+        callbacks=[MaxTrialsCallback(n_trials, states=None)],
+    )
+
+
+def _tune_worker(
+    tuner: HyperparameterTuner,
+    storage: str,
+    study_name: str,
+    pruner: optuna.pruners.BasePruner,
+    n_trials: int,
+) -> None:
+    # Parallelism comes from the worker processes; more threads per worker
+    # would only contend for the same cores.
+    torch.set_num_threads(1)
+    study = optuna.load_study(
+        study_name=study_name, storage=_open_storage(storage), pruner=pruner
+    )
+    _run_trials(tuner, study, n_trials)
@@ -0,0 +1,128 @@
+import contextlib
+import io
+import unittest
+from unittest import mock
+
+import optuna
+import torch
+
+import training
+
+
+def _data(n: int = 40, input_dim: int = 5, flip_val: bool = False):
+    """Returns random (X_tr, y_tr, X_val, y_val) tensors.
+
+    With `flip_val`, the validation labels are the opposite of what the
+    training data teaches, so the validation loss soon gets worse.
+    """
+    generator = torch.Generator().manual_seed(0)
+    X = torch.randn(2 * n, input_dim, generator=generator)
+    y = (X[:, :1] > 0).float()
+    y_val = 1 - y[n:] if flip_val else y[n:]
+    return X[:n], y[:n], X[n:], y_val
+
+
+class StubTuner:
+    """Stands in for HyperparameterTuner with a trivial objective."""
+
+    def objective(self, trial: optuna.Trial) -> float:
+        return trial.suggest_float("x", 0.0, 1.0)
+
+
+class TestTrainer(unittest.TestCase):
+    def setUp(self):
+        # Silences the progress bars and the summary of each run.
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        self.enterContext(contextlib.redirect_stderr(io.StringIO()))
+
+    def testBatchSizeTakesOneStepPerBatch(self):
+        X_tr, y_tr, X_val, y_val = _data(n=10)
+        full = training.Trainer(training.SurvivalModel(5, 4), 0.01, num_epochs=2)
+        with mock.patch.object(
+            full.optimizer, "step", wraps=full.optimizer.step
+        ) as step:
+            full.train(X_tr, y_tr, X_val, y_val)
+        self.assertEqual(2, step.call_count)
+
+        batched = training.Trainer(
+            training.SurvivalModel(5, 4), 0.01, batch_size=4, num_epochs=2
+        )
+        with mock.patch.object(
+            batched.optimizer, "step", wraps=batched.optimizer.step
+        ) as step:
+            batched.train(X_tr, y_tr, X_val, y_val)
+        # 10 rows in batches of 4 make 3 steps per epoch.
+        self.assertEqual(6, step.call_count)
+
+    def testPatienceStopsEarlyWithBestWeights(self):
+        data = _data(flip_val=True)
+        torch.manual_seed(0)
+        trainer = training.Trainer(
+            training.SurvivalModel(5, 8), 0.05, eval_every=2, patience=3
+        )
+        trainer.train(*data)
+        self.assertLess(trainer.epochs_run, trainer.num_epochs)
+        self.assertEqual(trainer.best_epoch + 3 * 2, trainer.epochs_run)
+
+        # The same run cut at best_epoch, never validated, ends with the
+        # weights the early-stopped run must have restored.
+        torch.manual_seed(0)
+        reference = training.Trainer(
+            training.SurvivalModel(5, 8),
+            0.05,
+            num_epochs=trainer.best_epoch,
+            eval_every=trainer.best_epoch + 1,
+        )
+        reference.train(*data)
+        for name, value in reference.model.state_dict().items():
+            torch.testing.assert_close(value, trainer.model.state_dict()[name])
+
+
+class TestPopulationTrainer(unittest.TestCase):
+    def setUp(self):
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        self.enterContext(contextlib.redirect_stderr(io.StringIO()))
+
+    def testMatchesPerModelTrainers(self):
+        data = _data()
+        hidden_dims, lrs = [4, 8, 3], [0.01, 0.05, 0.02]
+        torch.manual_seed(0)
+        models = training.StackedSurvivalModels(5, hidden_dims)
+        population = training.PopulationTrainer(
+            models, lrs, num_epochs=30, eval_every=10, patience=None
+        )
+        _, accuracies = population.train(*data)
+
+        # The stacked models are initialized like standalone models created
+        # in the same order from the same seed.
+        torch.manual_seed(0)
+        singles = [training.SurvivalModel(5, h) for h in hidden_dims]
+        for i, (model, lr) in enumerate(zip(singles, lrs)):
+            trainer = training.Trainer(
+                model, lr, num_epochs=30, eval_every=10, patience=None
+            )
+            _, accuracy, _ = trainer.train(*data)
+            self.assertAlmostEqual(accuracy, accuracies[i])
+            stacked = models.to_model(i).state_dict()
+            for name, value in model.state_dict().items():
+                torch.testing.assert_close(value, stacked[name])
+
+
+class TestRunTrials(unittest.TestCase):
+    def setUp(self):
+        optuna.logging.set_verbosity(optuna.logging.WARNING)
+
+    def testRunsOnlyTheRemainingTrials(self):
+        study = optuna.create_study(direction="maximize")
+        training._run_trials(StubTuner(), study, n_trials=3)
+        self.assertEqual(3, len(study.trials))
+        # A resumed study only runs the trials it still lacks.
+        training._run_trials(StubTuner(), study, n_trials=5)
+        self.assertEqual(5, len(study.trials))
+        # A complete study runs none.
+        training._run_trials(StubTuner(), study, n_trials=4)
+        self.assertEqual(5, len(study.trials))
+
+
+if __name__ == "__main__":
+    unittest.main()
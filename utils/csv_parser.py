@@ -1,13 +1,27 @@
 r"""CSV parser to parse CSV data into numpy arrays for subsequent ML pipeline.
 
 It provides the following features:
-  - Extracts out categorical data and apply with one-hot-encoding.
+  - Infers per-column types (numeric, date or categorical) from a sample of
+    rows, then converts whole columns at once with numpy.
+  - Extracts out categorical data and apply with one-hot-encoding, optionally
+    kept as a scipy CSR matrix.
   - Shuffle columns to cluster with non-categorical/categorical columns.
   - Extract headers.
+  - Optionally streams the file in fixed-size chunks so that peak memory is
+    bounded by the chunk size rather than the file size.
+  - Optionally caches the parsed data as .npy files, which are memory-mapped
+    on subsequent runs instead of reparsing the CSV file.
 """
 
 import csv
+import hashlib
+import itertools
+import json
 import numpy as np
+import os
+import scipy.sparse
+import shutil
+import tempfile
 import time
 
 from datetime import datetime
@@ -20,6 +34,17 @@ _DATETIME_PATTERNS = [
   '%Y-%m-%d',
 ]
 
+# Number of leading data rows used to infer the column types.
+_SCHEMA_SAMPLE_SIZE = 1000
+
+# Bumped whenever the cached data layout or parsing semantics change, so that
+# stale caches are not reused.
+_CACHE_VERSION = 1
+
+NUMERIC = 'numeric'
+DATE = 'date'
+CATEGORICAL = 'categorical'
+
 #
 # Common helper methods.
 #
@@ -40,6 +65,73 @@ def MaybeGetDate(value):
 def IsCategorical(value):
   return type(value) is str
 
+def InferColumnType(values):
+  """Infers the type of a column from a sample of its raw string values.
+
+  Empty values are ignored, as they are treated as missing.
+
+  Args:
+    values (list[str]): Sampled raw values of the column.
+
+  Returns: One of NUMERIC, DATE or CATEGORICAL.
+  """
+  values = [value for value in values if value != '']
+  if all(not IsCategorical(MaybeGetFloat(value)) for value in values):
+    return NUMERIC
+  if all(not IsCategorical(MaybeGetDate(value)) for value in values):
+    return DATE
+  return CATEGORICAL
+
+def ConvertColumn(values, column_type):
+  """Converts a column of raw string values according to its type.
+
+  Numeric columns are cast in one vectorized call. Date columns are parsed once
+  per distinct value. Missing values, and values that do not match a type
+  inferred from the sample, become NaN.
+
+  Args:
+    values (list[str]): Raw values of the column.
+    column_type (str): One of NUMERIC, DATE or CATEGORICAL.
+
+  Returns: Float numpy array, or string numpy array for categorical columns.
+  """
+  values = np.asarray(values)
+  if column_type == CATEGORICAL:
+    return values
+
+  result = np.full(len(values), np.nan)
+  present = values != ''
+  if column_type == NUMERIC:
+    try:
+      result[present] = values[present].astype(float)
+      return result
+    except ValueError:
+      parse = MaybeGetFloat
+  else:
+    parse = MaybeGetDate
+
+  uniques, inverse = np.unique(values[present], return_inverse=True)
+  parsed = [parse(value) for value in uniques.tolist()]
+  parsed = np.array(
+    [np.nan if IsCategorical(value) else value for value in parsed],
+    dtype=float)
+  result[present] = parsed[inverse]
+  return result
+
+def IterRowChunks(reader, chunk_size):
+  """Yields lists of at most chunk_size non-empty rows from a CSV reader."""
+  while True:
+    chunk = [row for row in itertools.islice(reader, chunk_size) if row]
+    if not chunk:
+      return
+    yield chunk
+
+def RowsToColumns(rows, num_columns):
+  """Transposes row lists into a list of num_columns raw value lists."""
+  if not rows:
+    return [[] for _ in range(num_columns)]
+  return [list(column) for column in zip(*rows)]
+
 
 class CsvParser(object):
 
@@ -48,147 +140,418 @@ class CsvParser(object):
   Args:
      filename (str): CSV filename.
      target_colname (str): Column name for the target variable.
+     chunk_size (int): If set, the file is not loaded eagerly. Instead a single
+       scanning pass collects categories, and IterData() re-reads the file
+       chunk_size rows at a time.
+     sparse (bool): If set, 'X' and 'X_test' are scipy CSR matrices, so the
+       one-hot-encoded columns are never densified.
+     cache_dir (str): If set, the parsed data is cached under this directory,
+       keyed by the CSV file's path, size and modification time. Later parsers
+       of the unchanged file memory-map the cached arrays instead of parsing.
   """
-  def __init__(self, filename, target_colname=None):
-    # Header and data extracted from CSV file.
-    self._raw_header = None
-    self._raw_data = []
+  def __init__(self, filename, target_colname=None, chunk_size=None,
+               sparse=False, cache_dir=None):
+    self._filename = filename
+    self._target_colname = target_colname
+    self._chunk_size = chunk_size
+    self._sparse = sparse
+    self._data = None
 
-    self._raw_train_data = []
-    self._raw_test_data = []
-    self._raw_target_data = []
-    self._raw_no_target_header = []
+    self._cache_path = None
+    if cache_dir is not None:
+      self._cache_path = os.path.join(cache_dir, self._GetCacheKey())
+      if os.path.isdir(self._cache_path):
+        self._LoadCache()
+        return
 
+    # Header and column types inferred from the leading rows of the CSV file.
     with open(filename, 'r') as f:
       csv_reader = csv.reader(f)
-      for row in csv_reader:
-        if self._raw_header is None:
-          self._raw_header = row
-        else:
-          self._raw_data.append(map(MaybeGetFloat, map(MaybeGetDate, row)))
-
-    if target_colname is not None:
-      target_colindex = self._raw_header.index(target_colname)
+      self._raw_header = next(csv_reader)
+      if chunk_size is None:
+        rows = [row for row in csv_reader if row]
+        sample = rows[:_SCHEMA_SAMPLE_SIZE]
+      else:
+        sample = next(IterRowChunks(csv_reader, _SCHEMA_SAMPLE_SIZE), [])
+    self._SetColumnTypes([
+      InferColumnType(column)
+      for column in RowsToColumns(sample, len(self._raw_header))
+    ])
+
+    if chunk_size is None:
+      train_columns, test_columns, target = self._SplitTarget(
+        RowsToColumns(rows, len(self._raw_header)))
+      del rows
+
+      # Category lookup tables and one-hot-encoding are fitted on training
+      # data only, and reused for the test data.
+      self._FitCategories({
+        i: set(train_columns[i].tolist()) for i in self._categorical_indexes
+      })
+
+      self._data = {
+        'X': self._EncodeColumns(train_columns),
+        'X_test': self._EncodeColumns(test_columns),
+        'y': target,
+        'X_schema': self._shuffled_header,
+        'y_schema': target_colname,
+      }
+    else:
+      self._ScanColumns()
+
+    if self._cache_path is not None:
+      self._WriteCache()
+
+  def _SetColumnTypes(self, column_types):
+    """Sets the column types, and derives the target and feature columns."""
+    self._column_types = column_types
+    self._target_colindex = None
+    self._raw_no_target_header = self._raw_header
+    self._feature_types = self._column_types
+    if self._target_colname is not None:
+      self._target_colindex = self._raw_header.index(self._target_colname)
       self._raw_no_target_header = (
-        self._raw_header[:target_colindex] + 
-        self._raw_header[target_colindex + 1 :]
+        self._raw_header[:self._target_colindex] +
+        self._raw_header[self._target_colindex + 1 :]
+      )
+      self._feature_types = (
+        self._column_types[:self._target_colindex] +
+        self._column_types[self._target_colindex + 1 :]
       )
-      for row in self._raw_data:
-        x = [row[i] for i in range(len(row)) if i != target_colindex]
-        y = row[target_colindex]
-        if row[target_colindex] == '':
-          self._raw_test_data.append(x)
-        else:
-          self._raw_train_data.append(x)
-          self._raw_target_data.append(y)
-
-    # Data splitted by non-categorical vs. categorical.
-    non_categorical_data, categorical_data, categories_count = (
-      self._SplitCategorialColumns(self._raw_train_data))
+    self._non_categorical_indexes = [
+      i for i in range(len(self._feature_types))
+        if self._feature_types[i] != CATEGORICAL]
+    self._categorical_indexes = [
+      i for i in range(len(self._feature_types))
+        if self._feature_types[i] == CATEGORICAL]
 
-    # Shuffled header corresponds to the splitted data and one hot encoding.
-    self._shuffled_header = []
-    if self._raw_train_data:
-      non_categorical_indexes = [
-        i for i in range(len(self._raw_train_data[0])) 
-          if not IsCategorical(self._raw_train_data[0][i])]
-      categorical_indexes = [
-        i for i in range(len(self._raw_train_data[0])) 
-          if IsCategorical(self._raw_train_data[0][i])]
-      for i in non_categorical_indexes:
-        self._shuffled_header.append(self._raw_no_target_header[i])
-      offset = 0
-      assert len(categorical_indexes) == len(categories_count)
-      for i in categorical_indexes:
-        self._shuffled_header.extend(
-          [self._raw_no_target_header[i] + '_' + str(j) 
-           for j in range(categories_count.values()[offset])]
-        )
-        offset += 1
-
-    # Apply one-hot-encoding to categorical data.
-    self._one_hot_encoder = preprocessing.OneHotEncoder()
-    self._one_hot_encoder.fit(categorical_data)
 
-    # Augment non-categorical and categorical data. For categorical data, apply
-    # one-hot-encoding.
-    encoded_categorical_data = self._one_hot_encoder.transform(
-      categorical_data).toarray()
+  def GetData(self):
+    """Returns the parsed data.
 
-    non_categorical_test_data, categorical_test_data, _ = (
-      self._SplitCategorialColumns(self._raw_test_data))
-    encoded_categorical_test_data = self._one_hot_encoder.transform(
-      categorical_test_data).toarray()
+    In chunked mode the chunks from IterData() are concatenated, so the result
+    is no longer memory bounded; prefer IterData() for large files.
+    """
+    if self._data is not None:
+      return self._data
 
-    self._data = {
-      'X': np.hstack((non_categorical_data, encoded_categorical_data)),
-      'X_test': np.hstack(
-        (non_categorical_test_data, encoded_categorical_test_data)),
-      'y': np.array(self._raw_target_data),
+    chunks = list(self.IterData())
+    if not chunks:
+      # A file with only a header yields no chunk; encode its empty columns
+      # like the eager mode does.
+      chunks = [self._EncodeChunk(
+        self._SplitTarget(RowsToColumns([], len(self._raw_header))))]
+    vstack = np.vstack
+    if self._sparse:
+      vstack = lambda blocks: scipy.sparse.vstack(blocks, format='csr')
+    return {
+      'X': vstack([chunk['X'] for chunk in chunks]),
+      'X_test': vstack([chunk['X_test'] for chunk in chunks]),
+      'y': np.concatenate([chunk['y'] for chunk in chunks]),
       'X_schema': self._shuffled_header,
-      'y_schema': target_colname,
+      'y_schema': self._target_colname,
     }
 
-  def GetData(self):
-    return self._data
+  def IterData(self):
+    """Yields the parsed data chunk by chunk.
+
+    Each chunk is a dict with the same keys as GetData(), where 'X', 'X_test'
+    and 'y' only hold the rows read in that chunk. Without chunk_size, or when
+    loaded from the cache, the whole data is yielded as a single chunk.
+    """
+    if self._data is not None:
+      yield self._data
+      return
+
+    for split in self._IterColumnChunks():
+      yield self._EncodeChunk(split)
+
+  def _EncodeChunk(self, split):
+    """Encodes a _SplitTarget() result as a chunk dict of IterData()."""
+    train_columns, test_columns, target = split
+    return {
+      'X': self._EncodeColumns(train_columns),
+      'X_test': self._EncodeColumns(test_columns),
+      'y': target,
+      'X_schema': self._shuffled_header,
+      'y_schema': self._target_colname,
+    }
+
+  def _IterColumnChunks(self):
+    """Re-reads the file and yields _SplitTarget() results per chunk."""
+    with open(self._filename, 'r') as f:
+      csv_reader = csv.reader(f)
+      next(csv_reader)
+      for rows in IterRowChunks(csv_reader, self._chunk_size):
+        yield self._SplitTarget(RowsToColumns(rows, len(self._raw_header)))
+
+  def _SplitTarget(self, raw_columns):
+    """Converts raw columns and splits them into train and test data.
+
+    Rows with an empty target value are test rows. Without a target column,
+    every row is treated as a training row.
+
+    Returns: Tuple of converted train feature columns, test feature columns and
+      the float target array.
+    """
+    if self._target_colindex is None:
+      columns = [
+        ConvertColumn(raw_columns[i], self._column_types[i])
+        for i in range(len(raw_columns))
+      ]
+      return columns, [column[:0] for column in columns], np.array([])
+
+    # As str, so that an empty column still compares elementwise below.
+    raw_target = np.asarray(raw_columns[self._target_colindex], dtype=str)
+    is_test = raw_target == ''
+    is_train = ~is_test
+    target = ConvertColumn(
+      raw_target[is_train], self._column_types[self._target_colindex])
+
+    train_columns, test_columns = [], []
+    for i in range(len(raw_columns)):
+      if i == self._target_colindex:
+        continue
+      column = ConvertColumn(raw_columns[i], self._column_types[i])
+      train_columns.append(column[is_train])
+      test_columns.append(column[is_test])
+    return train_columns, test_columns, target
+
+  def _ShuffleHeader(self, categories_count):
+    """Builds the header of non-categorical columns and one-hot columns.
+
+    Args:
+      categories_count (dict[int, int]): Number of categories by categorical
+        column index.
+    """
+    shuffled_header = []
+    for i in self._non_categorical_indexes:
+      shuffled_header.append(self._raw_no_target_header[i])
+    for i in self._categorical_indexes:
+      shuffled_header.extend(
+        [self._raw_no_target_header[i] + '_' + str(j)
+         for j in range(categories_count[i])]
+      )
+    return shuffled_header
 
   """Split by non-categorical and categorical columns.
 
-  ScikitLearn's one hot encoder requires that all categorical columns be in 
-  integer format. This method is the helper to convert raw data into that 
-  foramt.
+  ScikitLearn's one hot encoder requires that all categorical columns be in
+  integer format. This method is the helper to convert raw data into that
+  foramt, looking up each distinct value once in the fitted category tables.
+  Values unseen during fitting are coded as -1.
 
   Returns to sets of data that are column-splitted, such that one set consists
-  of non-categorical data, the other contains categorical data.
+  of non-categorical data, the other contains integer coded categorical data.
   """
-  def _SplitCategorialColumns(self, data):
-    if not data:
-      return []
-
-    # Cluster categorical columns together.
-    data = [
-      sorted(row, key=IsCategorical)
-      for row in data
-    ]
-    categorical_column_start_index = None
-    for i in range(len(data[0])):
-      if IsCategorical(data[0][i]):
-        categorical_column_start_index = i
-        break
-
-    if categorical_column_start_index is None:
-      return data
-
-    catetories_by_column_index = {
-      i: set()
-      for i in range(categorical_column_start_index, len(data[0]))
-    }
+  def _SplitCategorialColumns(self, columns):
+    num_rows = len(columns[0]) if columns else 0
 
     # Non-category data are copied as-is.
-    non_category_data = []
-    for row in data:
-      new_row = []
-      for i in range(len(row)):
-        if i < categorical_column_start_index:
-          new_row.append(row[i])
-        else:
-          catetories_by_column_index[i].add(row[i])
-      non_category_data.append(new_row)
+    non_category_data = np.array(
+      [columns[i] for i in self._non_categorical_indexes],
+      dtype=float).reshape(len(self._non_categorical_indexes), num_rows).T
 
     # Category data are transformed into integer values.
-    category_data = []
-    for row in data:
-      new_row = []
-      for i in range(len(row)):
-        if i in catetories_by_column_index:
-          categories = list(catetories_by_column_index[i])
-          new_row.append(categories.index(row[i]))
-      category_data.append(new_row)
-
-    # Keep track of number of elements per category.
-    categories_count = {
-      i: len(catetories_by_column_index[i])
-      for i in catetories_by_column_index
-    }
+    category_data = np.empty(
+      (num_rows, len(self._categorical_indexes)), dtype=int)
+    for j, i in enumerate(self._categorical_indexes):
+      values, inverse = np.unique(columns[i], return_inverse=True)
+      codes = np.array(
+        [self._category_codes[i].get(value, -1) for value in values.tolist()],
+        dtype=int)
+      category_data[:, j] = codes[inverse]
+
+    return non_category_data, category_data
+
+  """Scans the whole file once without retaining rows.
+
+  Only the distinct values of categorical columns are kept, so memory is
+  bounded by the column cardinalities instead of the row count.
+  """
+  def _ScanColumns(self):
+    categories_by_column_index = {i: set() for i in self._categorical_indexes}
+    self._num_rows = {'X': 0, 'X_test': 0}
+    for train_columns, test_columns, target in self._IterColumnChunks():
+      for i in self._categorical_indexes:
+        categories_by_column_index[i].update(train_columns[i].tolist())
+      self._num_rows['X'] += len(train_columns[0]) if train_columns else 0
+      self._num_rows['X_test'] += len(test_columns[0]) if test_columns else 0
+    self._FitCategories(categories_by_column_index)
+
+  """Builds category lookup tables, the shuffled header and one-hot-encoder.
+
+  Categories are numbered in sorted order, so codes are deterministic across
+  runs and processes. Categories that are not seen during fitting, e.g. only
+  occur in test rows, are encoded as all zeros.
+
+  Args:
+    categories_by_column_index (dict[int, set]): Distinct training values by
+      categorical column index.
+  """
+  def _FitCategories(self, categories_by_column_index):
+    self._category_codes = {}
+    for i in self._categorical_indexes:
+      self._category_codes[i] = {
+        value: code
+        for code, value in enumerate(sorted(categories_by_column_index[i]))
+      }
+
+    # Shuffled header corresponds to the splitted data and one hot encoding.
+    self._shuffled_header = self._ShuffleHeader({
+      i: len(self._category_codes[i]) for i in self._categorical_indexes
+    })
+
+    self._one_hot_encoder = None
+    if self._categorical_indexes:
+      self._one_hot_encoder = preprocessing.OneHotEncoder(
+        categories=[
+          list(range(len(self._category_codes[i])))
+          for i in self._categorical_indexes
+        ],
+        handle_unknown='ignore')
+      self._one_hot_encoder.fit(
+        [[0 for _ in self._categorical_indexes]])
 
-    return non_category_data, category_data, categories_count
+  def _EncodeColumns(self, columns):
+    """Encodes feature columns into an array laid out as the shuffled header.
+    """
+    num_rows = len(columns[0]) if columns else 0
+    if not num_rows:
+      if self._sparse:
+        return scipy.sparse.csr_matrix((0, len(self._shuffled_header)))
+      return np.zeros((0, len(self._shuffled_header)))
+
+    non_categorical_data, categorical_data = self._SplitCategorialColumns(
+      columns)
+    if self._one_hot_encoder is None:
+      if self._sparse:
+        return scipy.sparse.csr_matrix(non_categorical_data)
+      return non_categorical_data
+
+    # Augment non-categorical and categorical data. For categorical data, apply
+    # one-hot-encoding, which yields a sparse matrix.
+    encoded_categorical_data = self._one_hot_encoder.transform(
+      categorical_data)
+    if self._sparse:
+      return scipy.sparse.hstack(
+        (non_categorical_data, encoded_categorical_data), format='csr')
+    return np.hstack(
+      (non_categorical_data, encoded_categorical_data.toarray()))
+
+  def _GetCacheKey(self):
+    """Returns the cache key, which changes whenever the file is modified."""
+    stat = os.stat(self._filename)
+    key = repr((
+      _CACHE_VERSION,
+      os.path.abspath(self._filename),
+      stat.st_size,
+      stat.st_mtime,
+      self._target_colname,
+      self._sparse,
+    ))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+  """Writes the parsed data and the fitted schema to the cache directory.
+
+  Each array is written to its own .npy file; sparse matrices are written as
+  their CSR components. Files are written to a temporary directory that is
+  renamed into place, so that concurrent parsers never see a partial cache.
+  In dense chunked mode the arrays are filled chunk by chunk, so memory stays
+  bounded by the chunk size.
+  """
+  def _WriteCache(self):
+    cache_dir = os.path.dirname(self._cache_path)
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+    temp_path = tempfile.mkdtemp(dir=cache_dir)
+    save = lambda name, array: np.save(
+      os.path.join(temp_path, name + '.npy'), array)
+
+    try:
+      shapes = {}
+      if self._data is None and not self._sparse:
+        for key in ['X', 'X_test']:
+          shapes[key] = (self._num_rows[key], len(self._shuffled_header))
+        arrays = {
+          key: np.lib.format.open_memmap(
+            os.path.join(temp_path, key + '.npy'), mode='w+', dtype=float,
+            shape=shapes[key])
+          for key in shapes
+        }
+        offsets = {key: 0 for key in shapes}
+        target = []
+        for chunk in self.IterData():
+          for key in shapes:
+            arrays[key][offsets[key]:offsets[key] + len(chunk[key])] = (
+              chunk[key])
+            offsets[key] += len(chunk[key])
+          target.append(chunk['y'])
+        for key in shapes:
+          arrays[key].flush()
+        del arrays
+        save('y', np.concatenate(target))
+      else:
+        data = self.GetData()
+        for key in ['X', 'X_test']:
+          shapes[key] = data[key].shape
+          if self._sparse:
+            save(key + '_data', data[key].data)
+            save(key + '_indices', data[key].indices)
+            save(key + '_indptr', data[key].indptr)
+          else:
+            save(key, data[key])
+        save('y', data['y'])
+
+      metadata = {
+        'raw_header': self._raw_header,
+        'column_types': self._column_types,
+        'categories': {
+          str(i): sorted(codes, key=codes.get)
+          for i, codes in self._category_codes.items()
+        },
+        'shapes': shapes,
+      }
+      with open(os.path.join(temp_path, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f)
+
+      try:
+        os.rename(temp_path, self._cache_path)
+      except OSError:
+        # Another parser may have cached the same file concurrently.
+        if not os.path.isdir(self._cache_path):
+          raise
+    finally:
+      if os.path.isdir(temp_path):
+        shutil.rmtree(temp_path)
+
+  """Loads the parsed data and the fitted schema from the cache directory.
+
+  Arrays are memory-mapped read-only, so loading is near-instant regardless of
+  the data size, and pages are shared between processes.
+  """
+  def _LoadCache(self):
+    with open(os.path.join(self._cache_path, 'metadata.json'), 'r') as f:
+      metadata = json.load(f)
+    load = lambda name: np.load(
+      os.path.join(self._cache_path, name + '.npy'), mmap_mode='r')
+
+    self._raw_header = metadata['raw_header']
+    self._SetColumnTypes(metadata['column_types'])
+    self._FitCategories({
+      int(i): set(categories)
+      for i, categories in metadata['categories'].items()
+    })
+
+    self._data = {
+      'y': load('y'),
+      'X_schema': self._shuffled_header,
+      'y_schema': self._target_colname,
+    }
+    for key in ['X', 'X_test']:
+      if self._sparse:
+        self._data[key] = scipy.sparse.csr_matrix(
+          (load(key + '_data'), load(key + '_indices'), load(key + '_indptr')),
+          shape=tuple(metadata['shapes'][key]))
+      else:
+        self._data[key] = load(key)
@@ -1,7 +1,22 @@
 import numpy as np
+import os
+import scipy.sparse
+import shutil
+import tempfile
 import unittest
 
+from csv_parser import CATEGORICAL
+from csv_parser import ConvertColumn
 from csv_parser import CsvParser
+from csv_parser import DATE
+from csv_parser import InferColumnType
+from csv_parser import MaybeGetDate
+from csv_parser import NUMERIC
+
+# Timestamps of the dates in testdata/csv_parser_test.csv, which are parsed
+# in the local time zone.
+_JAN_1_2000 = MaybeGetDate('2000-01-01')
+_FEB_2_2001 = MaybeGetDate('2001-02-02')
 
 class TestSchemaInferencer(unittest.TestCase):
   def setUp(self):
@@ -14,29 +29,54 @@ class TestSchemaInferencer(unittest.TestCase):
       self._csv_parser._raw_header)
 
     self.assertEqual(
-      [
-       [1.0, 'y', '', 946713600.0, '1234-56-79', 2.3],
-       [2.0, 'y', 1.0, 981100800.0, '1234-56-79', 2.3],
-       [2.0, 'z', 0.0, 981100800.0, '1234-56-79', 2.3]
-      ],
-      self._csv_parser._raw_data)
+      [NUMERIC, CATEGORICAL, NUMERIC, DATE, CATEGORICAL, NUMERIC],
+      self._csv_parser._column_types)
 
     self.assertEqual(
-      [
-       [2.0, 'y', 981100800.0, '1234-56-79', 2.3],
-       [2.0, 'z', 981100800.0, '1234-56-79', 2.3]
-      ],
-      self._csv_parser._raw_train_data)
+      ['col1', 'col2', 'col4', 'col5', 'col6'],
+      self._csv_parser._raw_no_target_header)
 
-    self.assertEqual(
-      [
-       [1.0, 'y', 946713600.0, '1234-56-79', 2.3],
-      ],
-      self._csv_parser._raw_test_data)
+  def testInferColumnType(self):
+    self.assertEqual(NUMERIC, InferColumnType(['', '1', '0']))
+    self.assertEqual(DATE, InferColumnType(['2000-01-01', '']))
+    self.assertEqual(CATEGORICAL, InferColumnType(['1234-56-79']))
+    self.assertEqual(CATEGORICAL, InferColumnType(['1', 'y']))
+
+  def testConvertColumn(self):
+    np.testing.assert_array_equal(
+      np.array([np.nan, 1.0, 0.0]),
+      ConvertColumn(['', '1', '0'], NUMERIC))
+    np.testing.assert_array_equal(
+      np.array([_JAN_1_2000, _FEB_2_2001, _FEB_2_2001]),
+      ConvertColumn(['2000-01-01', '2001-02-02', '2001-02-02'], DATE))
+    np.testing.assert_array_equal(
+      np.array([1.0, np.nan]),
+      ConvertColumn(['1', 'x'], NUMERIC))
+    self.assertEqual(['y', 'z'], list(ConvertColumn(['y', 'z'], CATEGORICAL)))
 
+  def testCategoryCodes(self):
     self.assertEqual(
-      [1.0, 0.0],
-      self._csv_parser._raw_target_data)
+      {1: {'y': 0, 'z': 1}, 3: {'1234-56-79': 0}},
+      self._csv_parser._category_codes)
+
+    columns = [
+      np.array([1.0, 2.0]),
+      np.array(['z', 'w']),
+      np.array([3.0, 4.0]),
+      np.array(['1234-56-79', '1234-56-79']),
+      np.array([5.0, 6.0]),
+    ]
+    non_categorical_data, categorical_data = (
+      self._csv_parser._SplitCategorialColumns(columns))
+    np.testing.assert_array_equal(
+      np.array([[1.0, 3.0, 5.0], [2.0, 4.0, 6.0]]), non_categorical_data)
+    np.testing.assert_array_equal(
+      np.array([[1, 0], [-1, 0]]), categorical_data)
+    np.testing.assert_array_equal(
+      np.array([
+        [1.0, 3.0, 5.0, 0.0, 1.0, 1.0],
+        [2.0, 4.0, 6.0, 0.0, 0.0, 1.0]]),
+      self._csv_parser._EncodeColumns(columns))
 
   def testGetShuffledHeader(self):
     self.assertEqual(
@@ -48,13 +88,13 @@ class TestSchemaInferencer(unittest.TestCase):
 
     np.testing.assert_array_equal(
       np.array([
-        [2.0, 9.811008e+08, 2.3, 1.0, 0.0, 1.0],
-        [2.0, 9.811008e+08, 2.3, 0.0, 1.0, 1.0]]),
+        [2.0, _FEB_2_2001, 2.3, 1.0, 0.0, 1.0],
+        [2.0, _FEB_2_2001, 2.3, 0.0, 1.0, 1.0]]),
       data['X'])
 
     np.testing.assert_array_equal(
       np.array([
-        [1.0, 9.467136e+08, 2.3, 1.0, 0.0, 1.0]]),
+        [1.0, _JAN_1_2000, 2.3, 1.0, 0.0, 1.0]]),
       data['X_test'])
 
     np.testing.assert_array_equal(
@@ -67,5 +107,156 @@ class TestSchemaInferencer(unittest.TestCase):
 
     self.assertEqual('col3', data['y_schema'])
 
+
+class TestChunkedCsvParser(unittest.TestCase):
+  def setUp(self):
+    self._csv_parser = CsvParser(
+      'testdata/csv_parser_test.csv', 'col3', chunk_size=2)
+
+  def testIterData(self):
+    chunks = list(self._csv_parser.IterData())
+    self.assertEqual(2, len(chunks))
+
+    np.testing.assert_array_equal(
+      np.array([
+        [2.0, _FEB_2_2001, 2.3, 1.0, 0.0, 1.0]]),
+      chunks[0]['X'])
+    np.testing.assert_array_equal(
+      np.array([
+        [1.0, _JAN_1_2000, 2.3, 1.0, 0.0, 1.0]]),
+      chunks[0]['X_test'])
+    np.testing.assert_array_equal(np.array([1.]), chunks[0]['y'])
+
+    np.testing.assert_array_equal(
+      np.array([
+        [2.0, _FEB_2_2001, 2.3, 0.0, 1.0, 1.0]]),
+      chunks[1]['X'])
+    self.assertEqual((0, 6), chunks[1]['X_test'].shape)
+    np.testing.assert_array_equal(np.array([0.]), chunks[1]['y'])
+
+  def testGetDataMatchesEagerMode(self):
+    data = self._csv_parser.GetData()
+    expected = CsvParser('testdata/csv_parser_test.csv', 'col3').GetData()
+
+    np.testing.assert_array_equal(expected['X'], data['X'])
+    np.testing.assert_array_equal(expected['X_test'], data['X_test'])
+    np.testing.assert_array_equal(expected['y'], data['y'])
+    self.assertEqual(expected['X_schema'], data['X_schema'])
+    self.assertEqual(expected['y_schema'], data['y_schema'])
+
+  def testWithoutTargetMatchesEagerMode(self):
+    expected = CsvParser('testdata/csv_parser_test.csv').GetData()
+    csv_parser = CsvParser('testdata/csv_parser_test.csv', chunk_size=2)
+    for chunk in csv_parser.IterData():
+      self.assertEqual(np.float64, chunk['y'].dtype)
+      self.assertEqual((0,), chunk['y'].shape)
+    data = csv_parser.GetData()
+
+    np.testing.assert_array_equal(expected['X'], data['X'])
+    self.assertEqual((3, 7), data['X'].shape)
+    self.assertEqual((0, 7), data['X_test'].shape)
+    self.assertEqual(np.float64, expected['y'].dtype)
+    self.assertEqual(np.float64, data['y'].dtype)
+    self.assertEqual((0,), data['y'].shape)
+    self.assertIsNone(data['y_schema'])
+
+  def testHeaderOnlyMatchesEagerMode(self):
+    for sparse in [False, True]:
+      expected = CsvParser(
+        'testdata/csv_parser_header_only.csv', 'col3', sparse=sparse).GetData()
+      csv_parser = CsvParser(
+        'testdata/csv_parser_header_only.csv', 'col3', chunk_size=2,
+        sparse=sparse)
+      self.assertEqual([], list(csv_parser.IterData()))
+      data = csv_parser.GetData()
+
+      self.assertEqual(expected['X'].shape, data['X'].shape)
+      self.assertEqual(expected['X_test'].shape, data['X_test'].shape)
+      self.assertEqual(scipy.sparse.issparse(expected['X']),
+                       scipy.sparse.issparse(data['X']))
+      self.assertEqual(np.float64, data['y'].dtype)
+      self.assertEqual((0,), data['y'].shape)
+
+class TestSparseCsvParser(unittest.TestCase):
+  def testGetDataMatchesDenseMode(self):
+    expected = CsvParser('testdata/csv_parser_test.csv', 'col3').GetData()
+    for chunk_size in [None, 2]:
+      data = CsvParser(
+        'testdata/csv_parser_test.csv', 'col3', chunk_size=chunk_size,
+        sparse=True).GetData()
+
+      self.assertTrue(scipy.sparse.isspmatrix_csr(data['X']))
+      self.assertTrue(scipy.sparse.isspmatrix_csr(data['X_test']))
+      np.testing.assert_array_equal(expected['X'], data['X'].toarray())
+      np.testing.assert_array_equal(
+        expected['X_test'], data['X_test'].toarray())
+      np.testing.assert_array_equal(expected['y'], data['y'])
+      self.assertEqual(expected['X_schema'], data['X_schema'])
+
+class TestCachedCsvParser(unittest.TestCase):
+  def setUp(self):
+    self._cache_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._cache_dir)
+
+  def testLoadsFromCache(self):
+    expected = CsvParser('testdata/csv_parser_test.csv', 'col3').GetData()
+    for chunk_size in [None, 2]:
+      for sparse in [False, True]:
+        CsvParser(
+          'testdata/csv_parser_test.csv', 'col3', chunk_size=chunk_size,
+          sparse=sparse, cache_dir=self._cache_dir)
+        csv_parser = CsvParser(
+          'testdata/csv_parser_test.csv', 'col3', chunk_size=chunk_size,
+          sparse=sparse, cache_dir=self._cache_dir)
+        data = csv_parser.GetData()
+
+        X, X_test = data['X'], data['X_test']
+        if sparse:
+          # CSR components are read-only views of the memory-mapped files.
+          self.assertFalse(X.data.flags.writeable)
+          X, X_test = X.toarray(), X_test.toarray()
+        else:
+          self.assertIsInstance(X, np.memmap)
+        np.testing.assert_array_equal(expected['X'], X)
+        np.testing.assert_array_equal(expected['X_test'], X_test)
+        np.testing.assert_array_equal(expected['y'], data['y'])
+        self.assertEqual(expected['X_schema'], data['X_schema'])
+        self.assertEqual(expected['y_schema'], data['y_schema'])
+        self.assertEqual(
+          {1: {'y': 0, 'z': 1}, 3: {'1234-56-79': 0}},
+          csv_parser._category_codes)
+
+    # One cache entry per chunked/sparse combination, where chunked and eager
+    # modes share the same entry.
+    self.assertEqual(2, len(os.listdir(self._cache_dir)))
+
+  def testLoadsFromCacheWithoutTarget(self):
+    expected = CsvParser('testdata/csv_parser_test.csv').GetData()
+    # Chunked mode first, as eager and chunked modes share the cache entry.
+    for chunk_size in [2, None]:
+      CsvParser(
+        'testdata/csv_parser_test.csv', chunk_size=chunk_size,
+        cache_dir=self._cache_dir)
+      data = CsvParser(
+        'testdata/csv_parser_test.csv', chunk_size=chunk_size,
+        cache_dir=self._cache_dir).GetData()
+
+      self.assertEqual((3, 7), data['X'].shape)
+      np.testing.assert_array_equal(expected['X'], data['X'])
+      self.assertEqual((0, 7), data['X_test'].shape)
+      self.assertEqual((0,), data['y'].shape)
+
+  def testFileChangeInvalidatesCache(self):
+    filename = os.path.join(self._cache_dir, 'data.csv')
+    shutil.copy('testdata/csv_parser_test.csv', filename)
+    CsvParser(filename, 'col3', cache_dir=self._cache_dir)
+
+    with open(filename, 'a') as f:
+      f.write('3,z,1,2001-02-02,1234-56-79,2.3\n')
+    data = CsvParser(filename, 'col3', cache_dir=self._cache_dir).GetData()
+    self.assertEqual((3, 6), data['X'].shape)
+
 if __name__ == '__main__':
   unittest.main()
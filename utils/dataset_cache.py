@@ -0,0 +1,168 @@
+r"""Local, content-addressed cache of Kaggle datasets stored as Parquet.
+
+Tables are resolved by Kaggle handle and file path, e.g. ('titanic',
+'train.csv') for a competition or ('uciml/sms-spam-collection-dataset',
+'spam.csv') for a dataset. The first time a table is requested, its CSV file
+is fetched with kagglehub, parsed once with pandas and converted to Parquet
+by DuckDB. Later requests read the Parquet file back, without touching the
+network or reparsing the CSV.
+
+The cache directory holds:
+  - objects/<sha256>.parquet: converted tables, named by the hash of the raw
+    file and the conversion options, so identical downloads are stored once.
+  - refs/<key>.json: maps a (handle, path, options) request to its object.
+
+Offline mode (offline=True, or DATASETS_OFFLINE=1 in the environment) never
+downloads, and fails for tables that are not cached yet. A local directory
+(local_dir, or DATASETS_LOCAL_DIR) laid out as <local_dir>/<handle>/<path>
+can stand in for Kaggle, e.g. in tests or on machines without credentials.
+
+See dataset_cache_test.py for example usage.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import duckdb
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.path.join(
+  os.path.expanduser('~'), '.cache', 'kaggle_datasets')
+
+OFFLINE_ENV_VAR = 'DATASETS_OFFLINE'
+LOCAL_DIR_ENV_VAR = 'DATASETS_LOCAL_DIR'
+
+# Bump whenever the conversion to Parquet changes, to invalidate cached tables.
+_CACHE_VERSION = 1
+
+# Size of the blocks read when hashing downloaded files.
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+class DatasetCache(object):
+
+  """
+  Args:
+    cache_dir (str): Where converted tables are stored. Defaults to
+      DEFAULT_CACHE_DIR.
+    offline (bool): If True, only cached tables are served. Defaults to
+      whether DATASETS_OFFLINE is set to 1 or true.
+    local_dir (str): If set, raw files are read from
+      <local_dir>/<handle>/<path> instead of being downloaded from Kaggle.
+      Defaults to DATASETS_LOCAL_DIR.
+  """
+  def __init__(self, cache_dir=None, offline=None, local_dir=None):
+    self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    if offline is None:
+      offline = os.environ.get(OFFLINE_ENV_VAR, '').lower() in ('1', 'true')
+    self.offline = offline
+    self.local_dir = local_dir or os.environ.get(LOCAL_DIR_ENV_VAR)
+
+  def LoadTable(self, handle, path, competition=False, read_csv_kwargs=None,
+                refresh=False):
+    """Returns a cached table as a data frame, fetching it first if needed.
+
+    Args:
+      handle (str): Kaggle dataset handle like 'owner/name', or competition
+        name if competition is True.
+      path (str): Path of the CSV file within the dataset.
+      competition (bool): Whether handle names a competition.
+      read_csv_kwargs (dict): Extra pd.read_csv arguments used to parse the
+        file, e.g. {'encoding': 'latin1'}.
+      refresh (bool): If True, the file is fetched again even if cached.
+
+    Returns: pd.DataFrame with the table, as parsed by pd.read_csv.
+    """
+    return duckdb.read_parquet(self.TablePath(
+      handle, path, competition, read_csv_kwargs, refresh)).df()
+
+  def TablePath(self, handle, path, competition=False, read_csv_kwargs=None,
+                refresh=False):
+    """Like LoadTable, but returns the path of the cached Parquet file.
+
+    The file can be queried directly, e.g. with duckdb.read_parquet, without
+    loading the whole table in memory.
+    """
+    read_csv_kwargs = read_csv_kwargs or {}
+    ref_path = self._RefPath(handle, path, competition, read_csv_kwargs)
+    if os.path.exists(ref_path) and not refresh:
+      with open(ref_path, 'r') as f:
+        object_path = self._ObjectPath(json.load(f)['object'])
+      if os.path.exists(object_path):
+        return object_path
+
+    if self.offline:
+      raise IOError('%s from %s is not cached in %s and offline mode is on' % (
+        path, handle, self.cache_dir))
+
+    raw_path = self._Fetch(handle, path, competition, refresh)
+    object_key = _HashFile(raw_path, [_CACHE_VERSION, read_csv_kwargs])
+    object_path = self._ObjectPath(object_key)
+    if not os.path.exists(object_path):
+      df = pd.read_csv(raw_path, **read_csv_kwargs)
+      self._WriteAtomically(
+        object_path, lambda temp_path: duckdb.from_df(df).write_parquet(
+          temp_path))
+    self._WriteAtomically(ref_path, lambda temp_path: _WriteJson(temp_path, {
+      'handle': handle,
+      'path': path,
+      'competition': competition,
+      'read_csv_kwargs': read_csv_kwargs,
+      'object': object_key,
+    }))
+    return object_path
+
+  def _Fetch(self, handle, path, competition, refresh):
+    """Returns the local path of the raw file, downloading it if needed."""
+    if self.local_dir is not None:
+      raw_path = os.path.join(self.local_dir, handle, path)
+      if not os.path.exists(raw_path):
+        raise IOError('%s not found in local directory %s' % (
+          os.path.join(handle, path), self.local_dir))
+      return raw_path
+    # Imported lazily, so cached tables load without kagglehub installed.
+    import kagglehub
+    download = (kagglehub.competition_download if competition
+                else kagglehub.dataset_download)
+    return download(handle, path=path, force_download=refresh)
+
+  def _RefPath(self, handle, path, competition, read_csv_kwargs):
+    key = hashlib.sha1(json.dumps(
+      [handle, path, competition, read_csv_kwargs], sort_keys=True
+    ).encode('utf-8')).hexdigest()
+    return os.path.join(self.cache_dir, 'refs', key + '.json')
+
+  def _ObjectPath(self, object_key):
+    return os.path.join(self.cache_dir, 'objects', object_key + '.parquet')
+
+  def _WriteAtomically(self, path, write):
+    """Calls write with a temporary path, then renames it to path.
+
+    Concurrent readers and writers never see a partially written file.
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+      write(temp_path)
+      os.replace(temp_path, path)
+    finally:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+
+def _HashFile(path, options):
+  """Returns the sha256 of the file contents and the JSON-encoded options."""
+  digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8'))
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+def _WriteJson(path, value):
+  with open(path, 'w') as f:
+    json.dump(value, f)
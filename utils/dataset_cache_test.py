@@ -0,0 +1,109 @@
+import dataset_cache
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from pandas.testing import assert_frame_equal
+
+
+class TestDatasetCache(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.local_dir = os.path.join(self.temp_dir, 'kaggle')
+    self.cache_dir = os.path.join(self.temp_dir, 'cache')
+    os.makedirs(os.path.join(self.local_dir, 'owner', 'dataset'))
+    self.csv_path = os.path.join(self.local_dir, 'owner', 'dataset', 'data.csv')
+    self.df = pd.DataFrame({
+      'id': [1, 2, 3],
+      'age': [22.0, np.nan, 35.0],
+      'name': ['Braund', None, 'Heikkinen'],
+    })
+    self.df.to_csv(self.csv_path, index=False)
+    self.cache = dataset_cache.DatasetCache(
+      cache_dir=self.cache_dir, offline=False, local_dir=self.local_dir)
+
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+
+  def testLoadTable(self):
+    df = self.cache.LoadTable('owner/dataset', 'data.csv')
+    assert_frame_equal(pd.read_csv(self.csv_path), df)
+
+
+  def testTablePathIsParquet(self):
+    path = self.cache.TablePath('owner/dataset', 'data.csv')
+    self.assertTrue(path.endswith('.parquet'))
+    self.assertEqual((3,), duckdb.read_parquet(path).aggregate(
+      'count(*)').fetchone())
+
+
+  def testCachedTableIsReusedOffline(self):
+    expected = self.cache.LoadTable('owner/dataset', 'data.csv')
+    os.remove(self.csv_path)
+    offline_cache = dataset_cache.DatasetCache(
+      cache_dir=self.cache_dir, offline=True)
+    assert_frame_equal(
+      expected, offline_cache.LoadTable('owner/dataset', 'data.csv'))
+
+
+  def testOfflineMissingTableRaises(self):
+    offline_cache = dataset_cache.DatasetCache(
+      cache_dir=self.cache_dir, offline=True, local_dir=self.local_dir)
+    with self.assertRaises(IOError):
+      offline_cache.LoadTable('owner/dataset', 'data.csv')
+
+
+  def testOfflineFromEnvironment(self):
+    os.environ[dataset_cache.OFFLINE_ENV_VAR] = '1'
+    try:
+      self.assertTrue(dataset_cache.DatasetCache().offline)
+    finally:
+      del os.environ[dataset_cache.OFFLINE_ENV_VAR]
+
+
+  def testMissingLocalFileRaises(self):
+    with self.assertRaises(IOError):
+      self.cache.LoadTable('owner/dataset', 'missing.csv')
+
+
+  def testIdenticalContentIsStoredOnce(self):
+    os.makedirs(os.path.join(self.local_dir, 'other', 'dataset'))
+    shutil.copy(self.csv_path,
+                os.path.join(self.local_dir, 'other', 'dataset', 'data.csv'))
+    first = self.cache.TablePath('owner/dataset', 'data.csv')
+    second = self.cache.TablePath('other/dataset', 'data.csv')
+    self.assertEqual(first, second)
+    self.assertEqual(
+      1, len(os.listdir(os.path.join(self.cache_dir, 'objects'))))
+    self.assertEqual(2, len(os.listdir(os.path.join(self.cache_dir, 'refs'))))
+
+
+  def testReadCsvKwargs(self):
+    df = self.cache.LoadTable('owner/dataset', 'data.csv',
+                              read_csv_kwargs={'usecols': ['id']})
+    self.assertEqual(['id'], list(df.columns))
+    # Tables parsed with other options are cached separately.
+    self.assertEqual(3, len(self.cache.LoadTable(
+      'owner/dataset', 'data.csv').columns))
+
+
+  def testRefresh(self):
+    self.cache.LoadTable('owner/dataset', 'data.csv')
+    self.df.head(2).to_csv(self.csv_path, index=False)
+    self.assertEqual(3, len(self.cache.LoadTable('owner/dataset', 'data.csv')))
+    self.assertEqual(2, len(self.cache.LoadTable(
+      'owner/dataset', 'data.csv', refresh=True)))
+    self.assertEqual(2, len(self.cache.LoadTable('owner/dataset', 'data.csv')))
+
+
+if __name__ == '__main__':
+  unittest.main()
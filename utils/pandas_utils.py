@@ -5,7 +5,7 @@ mostly inspired from solutions posted online.
 See pandas_utils_test.py for example usage.
 """
 import pandas as pd
-import numpy as np
+import scipy.sparse
 
 from sklearn.feature_extraction import DictVectorizer
 
@@ -90,7 +90,7 @@ def AugmentColumns(df, cols_with_defaults):
   return new_df
 
 
-def OneHotEncode(df):
+def OneHotEncode(df, sparse=False):
   """Applies one-hot-encoding for non-numerical columns.
 
   Inspired from:
@@ -99,18 +99,29 @@ def OneHotEncode(df):
 
   Args:
     df (pd.DataFrame): DataFrame to apply one-hot-encoding.
+    sparse (bool): Whether to keep the encoded data as a scipy CSR matrix
+      instead of densifying it into a data frame. Useful for high cardinality
+      columns.
 
-  Returns: One-hot-encoded pd.DataFrame.
+  Returns: One-hot-encoded pd.DataFrame. If sparse, a tuple of the CSR matrix
+    and its list of column names, where the numerical columns come first
+    followed by the encoded columns.
   """
   vec = DictVectorizer()
-  cols = df.select_dtypes(include=[np.object]).columns
+  cols = df.select_dtypes(include=['object', 'string']).columns
 
   mkdict = lambda row: dict((col, row[col]) for col in cols)
-  vec_data = pd.DataFrame(
-    vec.fit_transform(df[cols].apply(mkdict, axis=1)).toarray())
-  vec_data.columns = vec.get_feature_names()
+  encoded = vec.fit_transform(df[cols].apply(mkdict, axis=1))
+  df = df.drop(cols, axis=1)
+
+  if sparse:
+    data = scipy.sparse.hstack(
+      (scipy.sparse.csr_matrix(df.values), encoded), format='csr')
+    return data, df.columns.tolist() + vec.get_feature_names_out().tolist()
+
+  vec_data = pd.DataFrame(encoded.toarray())
+  vec_data.columns = vec.get_feature_names_out().tolist()
   vec_data.index = df.index
   
-  df = df.drop(cols, axis=1)
   df = df.join(vec_data)
   return df
@@ -2,9 +2,10 @@ import pandas_utils
 
 import pandas as pd
 import numpy as np
+import scipy.sparse
 import unittest
 
-from pandas.util.testing import assert_frame_equal
+from pandas.testing import assert_frame_equal
 
 
 class TestSchemaInferencer(unittest.TestCase):
@@ -91,5 +92,21 @@ class TestSchemaInferencer(unittest.TestCase):
     }).sort_index(axis=1), df_encoded.sort_index(axis=1))
 
 
+  def testOneHotEncodeSparse(self):
+    df = pd.DataFrame({
+      'foo': [1, 2, 3],
+      'bar': ['a', 'b', 'a']
+    })
+    data, columns = pandas_utils.OneHotEncode(df, sparse=True)
+    self.assertTrue(scipy.sparse.isspmatrix_csr(data))
+    self.assertEqual(['foo', 'bar=a', 'bar=b'], columns)
+    np.testing.assert_array_equal(
+      np.array([
+        [1.0, 1.0, 0.0],
+        [2.0, 0.0, 1.0],
+        [3.0, 1.0, 0.0]]),
+      data.toarray())
+
+
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
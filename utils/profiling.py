@@ -0,0 +1,233 @@
+r"""Profiles tabular datasets with DuckDB.
+
+A profile holds, for every column, the null count and rate, the approximate
+number of distinct values, min and max, the most frequent values with their
+counts, and for numeric columns the mean and approximate quantiles. All of it
+is computed by a single query, in memory bounded by the number of columns and
+top values, and can be cached on disk keyed by a fingerprint of the data.
+
+Any data frame or CSV/Parquet file can be profiled, e.g. the Titanic, Kobe or
+SMS datasets:
+
+  python utils/profiling.py challenges/kobe/data.csv
+
+See profiling_test.py for example usage.
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import duckdb
+import pandas as pd
+
+DEFAULT_QUANTILES = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.99]
+DEFAULT_NUM_TOP_VALUES = 10
+
+# Bump whenever the profile layout changes, to invalidate cached profiles.
+_CACHE_VERSION = 1
+
+_NUMERIC_TYPES = (
+  'TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'UTINYINT',
+  'USMALLINT', 'UINTEGER', 'UBIGINT', 'FLOAT', 'DOUBLE', 'DECIMAL')
+
+
+def ProfileTable(source, cache_dir=None, quantiles=None,
+                 num_top_values=DEFAULT_NUM_TOP_VALUES):
+  """Profiles every column of a table in a single DuckDB pass.
+
+  Args:
+    source (pd.DataFrame|str|duckdb.DuckDBPyRelation): The table to profile:
+      a data frame, the path of a CSV or Parquet file, or a DuckDB relation.
+    cache_dir (str): If set, profiles are cached in this directory, keyed by
+      a fingerprint of the data and the profile options. Relations have no
+      fingerprint and are never cached.
+    quantiles (list[float]): Quantiles to compute for numeric columns.
+      Defaults to DEFAULT_QUANTILES.
+    num_top_values (int): Number of most frequent values kept per column.
+
+  Returns: A dict with 'num_rows' and 'columns', which maps each column name,
+    in table order, to a dict with 'type', 'null_count', 'null_rate',
+    'distinct_count', 'min', 'max' and 'top_values' (a list of dicts with
+    'value' and 'count', most frequent first). Numeric columns also have
+    'mean' and 'quantiles', which maps str(quantile) to its value. Values that
+    are neither numbers nor strings are given as strings.
+  """
+  quantiles = DEFAULT_QUANTILES if quantiles is None else quantiles
+  cache_path = None
+  if cache_dir is not None and not isinstance(source, duckdb.DuckDBPyRelation):
+    key = _Fingerprint(source, quantiles, num_top_values)
+    cache_path = os.path.join(cache_dir, key + '.json')
+    if os.path.exists(cache_path):
+      with open(cache_path, 'r') as f:
+        return json.load(f)
+
+  profile = _ComputeProfile(ToRelation(source), quantiles, num_top_values)
+
+  if cache_path is not None:
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'w') as f:
+        json.dump(profile, f)
+      os.replace(temp_path, cache_path)
+    finally:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+  return profile
+
+
+def FormatProfile(profile):
+  """Formats a profile returned by ProfileTable as a readable report.
+
+  Args:
+    profile (dict): The profile to format.
+
+  Returns: Multi-line string with one block per column.
+  """
+  lines = ['%d rows' % profile['num_rows']]
+  for name, column in profile['columns'].items():
+    stats = [
+      '%.1f%% null' % (100 * column['null_rate']),
+      '~%d distinct' % column['distinct_count'],
+      'min %s' % _FormatValue(column['min']),
+      'max %s' % _FormatValue(column['max']),
+    ]
+    if 'mean' in column:
+      stats.append('mean %s' % _FormatValue(column['mean']))
+    lines.append('%s (%s): %s' % (name, column['type'], ', '.join(stats)))
+    if column.get('quantiles'):
+      lines.append('  quantiles: ' + ', '.join(
+        'p%g=%s' % (100 * float(q), _FormatValue(v))
+        for q, v in column['quantiles'].items()))
+    lines.append('  top values: ' + ', '.join(
+      '%s (%d)' % (_FormatValue(top['value']), top['count'])
+      for top in column['top_values']))
+  return '\n'.join(lines)
+
+
+def ToRelation(source):
+  """Returns a DuckDB relation over a table.
+
+  Args:
+    source (pd.DataFrame|str|duckdb.DuckDBPyRelation): A data frame, the path
+      of a CSV or Parquet file, or a DuckDB relation, which is returned as is.
+
+  Returns: The duckdb.DuckDBPyRelation.
+  """
+  if isinstance(source, duckdb.DuckDBPyRelation):
+    return source
+  if isinstance(source, pd.DataFrame):
+    return duckdb.from_df(source)
+  if source.endswith('.parquet'):
+    return duckdb.read_parquet(source)
+  return duckdb.read_csv(source)
+
+
+def _Fingerprint(source, quantiles, num_top_values):
+  """Returns a cache key for profiling source with the given options.
+
+  Files are fingerprinted by path, size and modification time, like the
+  CsvParser cache, and data frames by a hash of their contents.
+  """
+  digest = hashlib.sha1()
+  digest.update(json.dumps(
+    [_CACHE_VERSION, quantiles, num_top_values]).encode('utf-8'))
+  if isinstance(source, pd.DataFrame):
+    digest.update(json.dumps(
+      [list(map(str, source.columns)), list(map(str, source.dtypes))]
+    ).encode('utf-8'))
+    digest.update(
+      pd.util.hash_pandas_object(source, index=False).values.tobytes())
+  else:
+    stat = os.stat(source)
+    digest.update(json.dumps(
+      [os.path.abspath(source), stat.st_size, stat.st_mtime]).encode('utf-8'))
+  return digest.hexdigest()
+
+
+def _ComputeProfile(relation, quantiles, num_top_values):
+  """Builds and runs the single aggregate query computing the profile.
+
+  A histogram of every value would take memory proportional to the number of
+  distinct values, e.g. a whole table of IDs. So the query first picks the
+  candidate top values of each column with approx_top_k, which is bounded by
+  num_top_values, and only counts those exactly.
+  """
+  aggregates = ['count(*)']
+  top_k = []
+  for i, (name, column_type) in enumerate(
+      zip(relation.columns, relation.types)):
+    column = '"%s"' % name.replace('"', '""')
+    top_k.append('approx_top_k(%s, %d) AS _top_%d'
+                 % (column, num_top_values, i))
+    aggregates += [
+      'count(%s)' % column,
+      'approx_count_distinct(%s)' % column,
+      'min(%s)' % column,
+      'max(%s)' % column,
+      # Most frequent values first, as {count, value} structs.
+      'list_slice(list_reverse_sort(list_transform(map_entries('
+      'histogram(%s) FILTER (WHERE list_contains(_top_%d, %s))),'
+      ' lambda e: struct_pack(count := e.value, value := e.key))), 1, %d)'
+      % (column, i, column, num_top_values),
+    ]
+    if _IsNumeric(column_type):
+      aggregates += [
+        'avg(%s)' % column,
+        'approx_quantile(%s, [%s])' % (
+          column, ', '.join(repr(float(q)) for q in quantiles)),
+      ]
+  row = iter(relation.query('_profiled', (
+    'WITH _top AS (SELECT %s FROM _profiled) SELECT %s FROM _profiled, _top'
+  ) % (', '.join(top_k), ', '.join(aggregates))).fetchone())
+
+  num_rows = next(row)
+  columns = {}
+  for name, column_type in zip(relation.columns, relation.types):
+    non_null_count, distinct_count, min_value, max_value, top_values = (
+      next(row) for _ in range(5))
+    null_count = num_rows - non_null_count
+    column = {
+      'type': str(column_type),
+      'null_count': null_count,
+      'null_rate': float(null_count) / num_rows if num_rows else 0.0,
+      'distinct_count': distinct_count,
+      'min': _ToJsonValue(min_value),
+      'max': _ToJsonValue(max_value),
+      'top_values': [
+        {'value': _ToJsonValue(top['value']), 'count': top['count']}
+        for top in top_values or []
+      ],
+    }
+    if _IsNumeric(column_type):
+      column['mean'] = next(row)
+      column['quantiles'] = dict(
+        (str(q), _ToJsonValue(v))
+        for q, v in zip(quantiles, next(row) or []))
+    columns[name] = column
+  return {'num_rows': num_rows, 'columns': columns}
+
+
+def _IsNumeric(column_type):
+  return str(column_type).startswith(_NUMERIC_TYPES)
+
+
+def _ToJsonValue(value):
+  if value is None or isinstance(value, (bool, int, float, str)):
+    return value
+  return str(value)
+
+
+def _FormatValue(value):
+  if isinstance(value, float):
+    return '%.4g' % value
+  return str(value)
+
+
+if __name__ == '__main__':
+  for path in sys.argv[1:]:
+    print(path)
+    print(FormatProfile(ProfileTable(path)))
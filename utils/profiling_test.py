@@ -0,0 +1,111 @@
+import profiling
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+
+class TestProfiling(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.df = pd.DataFrame({
+      'age': [22.0, 38.0, np.nan, 35.0, 38.0],
+      'sex': ['male', 'female', 'female', None, 'female'],
+    })
+
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+
+  def testProfileDataFrame(self):
+    profile = profiling.ProfileTable(self.df, quantiles=[0.5])
+    self.assertEqual(5, profile['num_rows'])
+    self.assertEqual(['age', 'sex'], list(profile['columns']))
+
+    age = profile['columns']['age']
+    self.assertEqual(1, age['null_count'])
+    self.assertAlmostEqual(0.2, age['null_rate'])
+    self.assertEqual(22.0, age['min'])
+    self.assertEqual(38.0, age['max'])
+    self.assertAlmostEqual(33.25, age['mean'])
+    self.assertEqual(['0.5'], list(age['quantiles']))
+    self.assertEqual({'value': 38.0, 'count': 2}, age['top_values'][0])
+
+    sex = profile['columns']['sex']
+    self.assertEqual(1, sex['null_count'])
+    self.assertEqual(2, sex['distinct_count'])
+    self.assertNotIn('mean', sex)
+    self.assertEqual([
+      {'value': 'female', 'count': 3},
+      {'value': 'male', 'count': 1},
+    ], sex['top_values'])
+
+
+  def testNumTopValues(self):
+    profile = profiling.ProfileTable(self.df, num_top_values=1)
+    self.assertEqual([{'value': 'female', 'count': 3}],
+                     profile['columns']['sex']['top_values'])
+
+
+  def testProfileCsvMatchesDataFrame(self):
+    path = os.path.join(self.temp_dir, 'data.csv')
+    self.df.to_csv(path, index=False)
+    self.assertEqual(profiling.ProfileTable(self.df),
+                     profiling.ProfileTable(path))
+
+
+  def testTopValuesOfUniqueColumn(self):
+    df = pd.DataFrame({'id': np.arange(1000)})
+    profile = profiling.ProfileTable(df, num_top_values=3)
+    top_values = profile['columns']['id']['top_values']
+    self.assertEqual(3, len(top_values))
+    self.assertEqual([1, 1, 1], [top['count'] for top in top_values])
+
+
+  def testCachedProfile(self):
+    cache_dir = os.path.join(self.temp_dir, 'cache')
+    profile = profiling.ProfileTable(self.df, cache_dir=cache_dir)
+    self.assertEqual(1, len(os.listdir(cache_dir)))
+    self.assertEqual(profile,
+                     profiling.ProfileTable(self.df.copy(), cache_dir=cache_dir))
+    self.assertEqual(1, len(os.listdir(cache_dir)))
+
+    # Different data or options get their own cache entry.
+    profiling.ProfileTable(self.df.head(3), cache_dir=cache_dir)
+    profiling.ProfileTable(self.df, cache_dir=cache_dir, quantiles=[0.5])
+    self.assertEqual(3, len(os.listdir(cache_dir)))
+
+
+  def testFailedCacheWriteLeavesNoTempFile(self):
+    cache_dir = os.path.join(self.temp_dir, 'cache')
+    with mock.patch.object(profiling.json, 'dump', side_effect=IOError):
+      with self.assertRaises(IOError):
+        profiling.ProfileTable(self.df, cache_dir=cache_dir)
+    self.assertEqual([], os.listdir(cache_dir))
+
+
+  def testRelationIsNotCached(self):
+    cache_dir = os.path.join(self.temp_dir, 'cache')
+    profile = profiling.ProfileTable(duckdb.sql('SELECT 1 AS one'),
+                                     cache_dir=cache_dir)
+    self.assertEqual(1, profile['num_rows'])
+    self.assertFalse(os.path.exists(cache_dir))
+
+
+  def testFormatProfile(self):
+    report = profiling.FormatProfile(profiling.ProfileTable(self.df))
+    self.assertIn('5 rows', report)
+    self.assertIn('age (DOUBLE): 20.0% null', report)
+    self.assertIn('top values: female (3), male (1)', report)
+
+
+if __name__ == '__main__':
+  unittest.main()